@@ -1,17 +1,132 @@
-import os
-from flask import Flask, request, abort, jsonify
+import math
+from datetime import timedelta
+
+import click
+from flask import Flask, Response, request, abort
 from flask_cors import CORS
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import HTTPException
+
+from coalesce import CoalesceTimeout, coalesced, setup_coalescing
+from compression import compress_response, setup_compression
+from config import DEFAULTS, load_config
+from jobs import enqueue, run_workers, validate_job, KINDS
+from models import db, setup_db, bulk_delete, Actor, Movie, Change, ChangeCompaction, Job
+from negotiation import get_body, jsonify, vary_on_accept
+import partitioning
+from ratelimit import RateLimitExceeded, ratelimit_headers, setup_ratelimit
+from stream import Subscriber, event_stream, setup_stream
+from validation import ACTOR_CREATE, ACTOR_UPDATE, MOVIE_CREATE, MOVIE_UPDATE, ValidationError
+from auth import AuthError, check_permissions, requires_auth
+
+'''
+check_version(model, body) method
+    @INPUTS
+        model: the Actor or Movie about to be updated
+        body: the decoded json request body
+
+    the expected version comes from the If-Match header (the ETag of a
+    previous response, such as "3") or else from a 'version' field in the
+    body; both are optional, and If-Match: * matches any version
+    it will raise a StaleDataError if the expected version is not the loaded one
+'''
+def check_version(model, body):
+    if request.if_match:
+        # a weak W/"3" is taken as "3"
+        expected = request.headers['If-Match']
+        stale = not (request.if_match.star_tag or request.if_match.contains_weak(str(model.version)))
+    elif 'version' in body:
+        expected = body['version']
+        stale = str(expected) != str(model.version)
+    else:
+        return
+
+    if stale:
+        raise StaleDataError(
+            f"{model.__tablename__} {model.id} is at version {model.version}, not {expected}"
+        )
+
+'''
+with_etag(response, model) method
+    sets the ETag header to the model's version, quoted ("3"): the value
+    check_version expects back in If-Match
+    return the response
+'''
+def with_etag(response, model):
+    response.set_etag(str(model.version))
+    return response
+
+'''
+parse_ids(raw, max_ids) method
+    @INPUTS
+        raw: "1,2,3" from a query string or [1, 2, 3] from a json body
+        max_ids: the BATCH_MAX_IDS limit
+
+    it will abort with 400 if a query string id is not an integer or there are too many ids
+    it will abort with 422 if a json id is not an integer; 1.9, "1" and true are rejected, not coerced
+    return the ids in request order with duplicates removed
+'''
+def parse_ids(raw, max_ids):
+    if isinstance(raw, str):
+        try:
+            raw = [int(part) for part in raw.split(',') if part.strip()]
+        except ValueError:
+            abort(400)
+    if not isinstance(raw, list) or not raw:
+        abort(400)
+    if any(isinstance(id, bool) or not isinstance(id, int) for id in raw):
+        abort(422)
+    ids = list(dict.fromkeys(raw))
+    if len(ids) > max_ids:
+        abort(400)
+    return ids
+
+'''
+int_arg(name, default) method
+    an integer query string parameter
+    it will abort with 400 if the parameter is present but not an integer,
+    instead of falling back to the default like request.args.get(type=int)
+    return the integer, or default when the parameter is missing
+'''
+def int_arg(name, default):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
 
-from models import setup_db, Actor, Movie
-from auth import AuthError, requires_auth
+'''
+fetch_by_ids(query, model, ids) method
+    resolves every id with a single IN query
+    return (formatted rows in request order, ids that were not found)
+'''
+def fetch_by_ids(query, model, ids):
+    rows = {row.id: row for row in query.filter(model.id.in_(ids))}
+    found = [rows[id].format() for id in ids if id in rows]
+    missing = [id for id in ids if id not in rows]
+    return found, missing
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
 
+    # test_config replaces the environment so tests never depend on setup.sh
+    app.config.from_mapping(DEFAULTS)
+    if test_config is None:
+        app.config.from_mapping(load_config())
+    else:
+        app.config.from_mapping(test_config)
+
     # Manually Push a Context https://flask.palletsprojects.com/en/2.2.x/appcontext/
     with app.app_context():
         setup_db(app)
+    setup_compression(app)
+    setup_ratelimit(app)
+    setup_coalescing(app)
+    setup_stream(app)
 
     cors = CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 
@@ -23,13 +138,16 @@ def create_app(test_config=None):
         response.headers.add(
             "Access-Control-Allow-Methods", "GET,POST,PATCH,DELETE,OPTIONS"
         )
-        return response
+        ratelimit_headers(response)
+        vary_on_accept(response)
+        return compress_response(response)
   
     # ROUTES
     '''
     GET /actors
         it will require the 'get:actors' permission
         it will contain the actor.format() data representation
+        identical concurrent requests share one query and body (see coalesce.py)
     returns status code 200 and json {"success": True, "actors": actors} where actors is the list of actors
         or appropriate status code indicating reason for failure
     '''
@@ -37,7 +155,11 @@ def create_app(test_config=None):
     # JSON Response body keys: 'success', and 'actors'
     @app.route('/api/v1/actors')
     @requires_auth('get:actors')
+    @coalesced
     def get_actors(payload):
+        if 'ids' in request.args:
+            return get_actors_batch(request.args['ids'])
+
         actors = Actor.query.order_by(Actor.id).all()
         fromatted_actors = [actor.format() for actor in actors]
         return jsonify({
@@ -45,28 +167,57 @@ def create_app(test_config=None):
             "actors": fromatted_actors
         })
 
+    '''
+    GET /actors?ids=<id>,<id>,...
+    POST /actors/batch with json {"ids": [<id>, <id>, ...]} for long id lists
+        it will require the 'get:actors' permission
+        it will resolve every id with one query; at most BATCH_MAX_IDS ids
+        it will contain the actor.format() data representation
+    returns status code 200 and json {"success": True, "actors": actors, "missing": ids}
+        where actors follow the request order and missing lists the ids that do not exist
+        or appropriate status code indicating reason for failure
+    '''
+    @app.route('/api/v1/actors/batch', methods=['POST'])
+    @requires_auth('get:actors')
+    def post_actors_batch(payload):
+        body = get_body() or {}
+        return get_actors_batch(body.get('ids'))
+
+    def get_actors_batch(raw_ids):
+        ids = parse_ids(raw_ids, app.config['BATCH_MAX_IDS'])
+        actors, missing = fetch_by_ids(Actor.query, Actor, ids)
+        return jsonify({
+            "success": True,
+            "actors": actors,
+            "missing": missing
+        })
+
     '''
     GET /actors/<id>
         where <id> is the existing model id
         it will require the 'get:actors' permission
         it will contain the actor.format() data representation
+        the ETag header carries the actor's version, for If-Match on a later PATCH
     returns status code 200 and json {"success": True, "actors": actor} where actor an array containing only the actor with id '<id>'
         or appropriate status code indicating reason for failure
     '''
     @app.route('/api/v1/actors/<int:id>')
     @requires_auth('get:actors')
+    @coalesced
     def get_actor_detail(payload,id):
         actor = Actor.query.get_or_404(id)
 
-        return jsonify({
+        return with_etag(jsonify({
             "success": True,
             'actors': [actor.format()]
-        }), 200
+        }), actor)
     
     '''
     POST /actors
         it will create a new row in the actors table
         it will require the 'post:actors' permission
+        it will respond with a 400 error listing every missing or invalid field
+            (name, gender, dob) before any database work
         it will contain the actor.format() data representation
     returns status code 200 and json {"success": True, "actors": actor} where actor an array containing only the newly created actor
         or appropriate status code indicating reason for failure
@@ -74,10 +225,7 @@ def create_app(test_config=None):
     @app.route('/api/v1/actors', methods=['POST'])
     @requires_auth('post:actors')
     def post_actor(payload):
-        body = request.get_json()
-
-        if 'name' and 'gender' and 'dob' not in body:
-            abort(400)
+        body = ACTOR_CREATE.validate(get_body())
 
         new_name = body['name']
         new_gender = body['gender']
@@ -86,12 +234,12 @@ def create_app(test_config=None):
         try:
             actor = Actor(name=new_name, gender=new_gender, dob=new_dob)
             actor.insert()
-            return jsonify(
+            return with_etag(jsonify(
                 {
                     "success": True,
                     'actors': [actor.format()]
                 }
-            )
+            ), actor)
         except:
             abort(422)
 
@@ -99,8 +247,11 @@ def create_app(test_config=None):
     PATCH /actors/<id>
         where <id> is the existing model id
         it will respond with a 404 error if <id> is not found
+        it will respond with a 409 error if the If-Match header or 'version' field is stale
+        it will respond with a 400 error listing every invalid field before any database work
         it will update the corresponding row for <id>
         it will require the 'patch:actors' permission
+        the ETag header carries the actor's new version
         it will contain the actor.format() data representation
     returns status code 200 and json {"success": True, "actors": actor} where actor an array containing only the updated actor
         or appropriate status code indicating reason for failure
@@ -108,13 +259,14 @@ def create_app(test_config=None):
     @app.route('/api/v1/actors/<int:id>', methods=['PATCH'])
     @requires_auth('patch:actors')
     def patch_actor(payload,id):
+        body = ACTOR_UPDATE.validate(get_body())
         try:
             actor = Actor.query.filter(Actor.id == id).one_or_none()
             
             if actor is None:
                 abort(404)
             
-            body = request.get_json()
+            check_version(actor, body)
             if 'name' in body:
                 actor.name = body['name']
             if 'gender' in body:
@@ -123,12 +275,18 @@ def create_app(test_config=None):
                 actor.dob = body['dob']
 
             actor.update()
-            return jsonify(
+            return with_etag(jsonify(
                 {
                     "success": True,
                     'actors': [actor.format()]
                 }
-            )
+            ), actor)
+        except StaleDataError:
+            db.session.rollback()
+            abort(409)
+        except HTTPException:
+            # abort(404) for an unknown id, not a 422
+            raise
         except:
             abort(422)
     
@@ -158,46 +316,121 @@ def create_app(test_config=None):
             })
         except:
             abort(422)
+
+    '''
+    DELETE /actors?ids=<id>,<id>,...
+    DELETE /actors with json {"ids": [<id>, <id>, ...]} for long id lists
+        it will require the 'delete:actors' permission
+        it will delete every listed row with one statement, without loading them,
+            its cast entries going with them (ON DELETE CASCADE); at most BATCH_MAX_IDS ids
+        ids that do not exist are ignored
+    returns status code 200 and json {"success": True, "deleted": count}
+        or appropriate status code indicating reason for failure
+    '''
+    @app.route('/api/v1/actors', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    def delete_actors(payload):
+        if 'ids' in request.args:
+            raw_ids = request.args['ids']
+        else:
+            raw_ids = (get_body() or {}).get('ids')
+        ids = parse_ids(raw_ids, app.config['BATCH_MAX_IDS'])
+
+        deleted = bulk_delete(Actor, ids)
+        db.session.commit()
+        return jsonify({
+            "success": True,
+            "deleted": deleted
+        })
     
     '''
     GET /movies
         it will require the 'get:movies' permission
         it will contain only the movie.format() data representation
+        identical concurrent requests share one query and body (see coalesce.py)
     returns status code 200 and json {"success": True, "movies": movies} where movies is the list of movies
         or appropriate status code indicating reason for failure
+
+    GET /movies?compact=true
+        it will answer from the movies table alone with one query
+        it will contain the movie.format_compact() data representation,
+            cast_count and cast_ids instead of the cast's actors
     '''
     @app.route('/api/v1/movies')
     @requires_auth('get:movies')
+    @coalesced
     def get_movies(payload):
-        movies = Movie.query.order_by(Movie.id).all()
+        if 'ids' in request.args:
+            return get_movies_batch(request.args['ids'])
+
+        if request.args.get('compact') == 'true':
+            movies = Movie.query.order_by(Movie.id).all()
+            return jsonify({
+                "success": True,
+                "movies": [movie.format_compact() for movie in movies]
+            })
+
+        # every cast in one extra query instead of one lazy load per movie
+        movies = Movie.query.options(selectinload(Movie.cast)).order_by(Movie.id).all()
         fromatted_movies = [movie.format() for movie in movies]
         return jsonify({
             "success": True,
             "movies": fromatted_movies
         })
 
+    '''
+    GET /movies?ids=<id>,<id>,...
+    POST /movies/batch with json {"ids": [<id>, <id>, ...]} for long id lists
+        it will require the 'get:movies' permission
+        it will resolve every id with one query plus one query for all their casts
+        at most BATCH_MAX_IDS ids
+        it will contain the movie.format() data representation
+    returns status code 200 and json {"success": True, "movies": movies, "missing": ids}
+        where movies follow the request order and missing lists the ids that do not exist
+        or appropriate status code indicating reason for failure
+    '''
+    @app.route('/api/v1/movies/batch', methods=['POST'])
+    @requires_auth('get:movies')
+    def post_movies_batch(payload):
+        body = get_body() or {}
+        return get_movies_batch(body.get('ids'))
+
+    def get_movies_batch(raw_ids):
+        ids = parse_ids(raw_ids, app.config['BATCH_MAX_IDS'])
+        query = Movie.query.options(selectinload(Movie.cast))
+        movies, missing = fetch_by_ids(query, Movie, ids)
+        return jsonify({
+            "success": True,
+            "movies": movies,
+            "missing": missing
+        })
+
     '''
     GET /movies/<id>
         where <id> is the existing model id
         it will require the 'get:movies' permission
         it will contain the movie.format() data representation
+        the ETag header carries the movie's version, for If-Match on a later PATCH
     returns status code 200 and json {"success": True, "movies": movie} where movie an array containing only the movie with id '<id>'
         or appropriate status code indicating reason for failure
     '''
     @app.route('/api/v1/movies/<int:id>')
     @requires_auth('get:movies')
+    @coalesced
     def get_movie_detail(payload,id):
-        movie = Movie.query.get_or_404(id)
+        movie = Movie.query.options(selectinload(Movie.cast)).get_or_404(id)
 
-        return jsonify({
+        return with_etag(jsonify({
             "success": True,
             'movies': [movie.format()]
-        }), 200
+        }), movie)
     
     '''
     POST /movies
         it will create a new row in the movies table
         it will require the 'post:movies' permission
+        it will respond with a 400 error listing every missing or invalid field
+            (title, release_date, cast) before any database work
         it will contain the movie.format() data representation
     returns status code 200 and json {"success": True, "movies": movie} where movie an array containing only the newly created movie
         or appropriate status code indicating reason for failure
@@ -205,27 +438,26 @@ def create_app(test_config=None):
     @app.route('/api/v1/movies', methods=['POST'])
     @requires_auth('post:movies')
     def post_movie(payload):
-        body = request.get_json()
-
-        if 'title' and 'release_date' not in body:
-            abort(400)
+        body = MOVIE_CREATE.validate(get_body())
 
         new_title = body['title']
         new_release_date = body['release_date']
+        new_cast = []
         if 'cast' in body:
-            for id in body["cast"]:
-                Actor.query.get_or_404(id)
+            # one IN query; any id it does not return is unknown
             new_cast = Actor.query.filter(Actor.id.in_(body["cast"])).all()
+            if len(new_cast) != len(set(body["cast"])):
+                abort(404)
 
         try:
             movie = Movie(title=new_title, release_date=new_release_date, cast=new_cast)
             movie.insert()
-            return jsonify(
+            return with_etag(jsonify(
                 {
                     "success": True,
                     'movies': [movie.format()]
                 }
-            )
+            ), movie)
         except:
             abort(422)
 
@@ -233,8 +465,11 @@ def create_app(test_config=None):
     PATCH /movies/<id>
         where <id> is the existing model id
         it will respond with a 404 error if <id> is not found
+        it will respond with a 409 error if the If-Match header or 'version' field is stale
+        it will respond with a 400 error listing every invalid field before any database work
         it will update the corresponding row for <id>
         it will require the 'patch:movies' permission
+        the ETag header carries the movie's new version
         it will contain the movie.format() data representation
     returns status code 200 and json {"success": True, "movies": movie} where movie an array containing only the updated movie
         or appropriate status code indicating reason for failure
@@ -242,29 +477,40 @@ def create_app(test_config=None):
     @app.route('/api/v1/movies/<int:id>', methods=['PATCH'])
     @requires_auth('patch:movies')
     def patch_movie(payload,id):
+        body = MOVIE_UPDATE.validate(get_body())
         try:
             movie = Movie.query.filter(Movie.id == id).one_or_none()
             
             if movie is None:
                 abort(404)
             
-            body = request.get_json()
+            check_version(movie, body)
+            # the cast goes first: its queries would otherwise autoflush the
+            # title change and update the movie row twice
+            if 'cast' in body:
+                cast_ids = set(body["cast"])
+                found = Actor.query.filter(Actor.id.in_(cast_ids)).count()
+                if found != len(cast_ids):
+                    abort(404)
+                movie.set_cast(cast_ids)
             if 'title' in body:
                 movie.title = body['title']
             if 'release_date' in body:
                 movie.release_date = body['release_date']
-            if 'cast' in body:
-                for id in body["cast"]:
-                    Actor.query.get_or_404(id)
-                movie.cast = Actor.query.filter(Actor.id.in_(body["cast"])).all()
 
             movie.update()
-            return jsonify(
+            return with_etag(jsonify(
                 {
                     "success": True,
                     'movies': [movie.format()]
                 }
-            )
+            ), movie)
+        except StaleDataError:
+            db.session.rollback()
+            abort(409)
+        except HTTPException:
+            # abort(404) for an unknown id, not a 422
+            raise
         except:
             abort(422)
     
@@ -294,6 +540,259 @@ def create_app(test_config=None):
             })
         except:
             abort(422)
+
+    '''
+    DELETE /movies?ids=<id>,<id>,...
+    DELETE /movies with json {"ids": [<id>, <id>, ...]} for long id lists
+        it will require the 'delete:movies' permission
+        it will delete every listed row with one statement, without loading them,
+            the movie's cast going with them (ON DELETE CASCADE); at most BATCH_MAX_IDS ids
+        ids that do not exist are ignored
+    returns status code 200 and json {"success": True, "deleted": count}
+        or appropriate status code indicating reason for failure
+    '''
+    @app.route('/api/v1/movies', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    def delete_movies(payload):
+        if 'ids' in request.args:
+            raw_ids = request.args['ids']
+        else:
+            raw_ids = (get_body() or {}).get('ids')
+        ids = parse_ids(raw_ids, app.config['BATCH_MAX_IDS'])
+
+        deleted = bulk_delete(Movie, ids)
+        db.session.commit()
+        return jsonify({
+            "success": True,
+            "deleted": deleted
+        })
+
+    '''
+    GET /changes?since=<cursor>&limit=<n>
+        it will require the 'get:movies' permission
+        actor events are only included when the token also has 'get:actors'
+        it will contain the change.format() data representation, oldest first
+        create and update events should be applied as upserts; delete events are tombstones
+        it will respond with a 410 error if <cursor> is older than the compacted floor
+    returns status code 200 and json {"success": True, "changes": changes, "next": cursor, "has_more": bool}
+        where "next" is the cursor to pass as since on the following call
+        or appropriate status code indicating reason for failure
+    '''
+    @app.route('/api/v1/changes')
+    @requires_auth('get:movies')
+    @coalesced
+    def get_changes(payload):
+        since = int_arg('since', 0)
+        limit = int_arg('limit', app.config['CHANGES_PAGE_SIZE'])
+        if since < 0 or limit < 1:
+            abort(400)
+        limit = min(limit, app.config['CHANGES_MAX_PAGE_SIZE'])
+
+        if since < ChangeCompaction.current_floor():
+            abort(410)
+
+        query = Change.query.filter(Change.id > since)
+        if 'get:actors' not in payload['permissions']:
+            query = query.filter(Change.entity != 'actor')
+        # one extra row tells us whether another page follows
+        changes = query.order_by(Change.id).limit(limit + 1).all()
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        return jsonify({
+            "success": True,
+            "changes": [change.format() for change in changes],
+            "next": changes[-1].id if changes else since,
+            "has_more": has_more
+        })
+
+    '''
+    GET /stream
+        it will require the 'get:movies' permission
+        actor events are only included when the token also has 'get:actors'
+        it will stream change.format() rows as server sent events (text/event-stream)
+            "id" is the change cursor, "event" is "change" and "data" the json event
+        a reconnecting client sends Last-Event-ID (or ?since=<cursor>) and the missed events are replayed first
+        a ": heartbeat" comment is sent after STREAM_HEARTBEAT seconds without events
+        an "overflow" event ends the stream when the client falls too far behind; reconnect to resume
+        it will respond with a 410 error if the cursor is older than the compacted floor
+            or has more than CHANGES_MAX_PAGE_SIZE events to replay; catch up through GET /changes
+    '''
+    @app.route('/api/v1/stream')
+    @requires_auth('get:movies')
+    def stream_changes(payload):
+        broker = app.extensions.get('change_broker')
+        if broker is None:
+            abort(404)
+
+        since = request.headers.get('Last-Event-ID', request.args.get('since'))
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                abort(400)
+            if since < ChangeCompaction.current_floor():
+                abort(410)
+
+        subscriber = Subscriber(
+            app.config['STREAM_BUFFER_SIZE'],
+            'get:actors' in payload['permissions']
+        )
+        # subscribe before reading the backlog so no commit falls in between
+        broker.subscribe(subscriber)
+
+        backlog = []
+        if since is not None:
+            subscriber.last_id = since
+            limit = app.config['CHANGES_MAX_PAGE_SIZE']
+            query = Change.query.filter(Change.id > since)
+            if not subscriber.include_actors:
+                query = query.filter(Change.entity != 'actor')
+            backlog = [change.format() for change in query.order_by(Change.id).limit(limit + 1)]
+            if len(backlog) > limit:
+                broker.unsubscribe(subscriber)
+                abort(410)
+
+        return Response(
+            event_stream(broker, subscriber, backlog, app.config['STREAM_HEARTBEAT']),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    '''
+    GET /admin/slow-queries?limit=<n>
+        it will require the 'get:slow-queries' permission
+        it will contain the newest slow statements first, each with its route, duration,
+            redacted parameters and, for a sampled subset, the captured plan
+    returns status code 200 and json {"success": True, "slow_queries": entries, "threshold_ms": ms}
+        or appropriate status code indicating reason for failure
+    '''
+    @app.route('/api/v1/admin/slow-queries')
+    @requires_auth('get:slow-queries')
+    def get_slow_queries(payload):
+        log = app.extensions.get('slow_query_log')
+        if log is None:
+            abort(404)
+        limit = int_arg('limit', 100)
+        if limit < 1:
+            abort(400)
+
+        return jsonify({
+            "success": True,
+            "slow_queries": log.recent(limit),
+            "threshold_ms": app.config['SLOW_QUERY_THRESHOLD_MS']
+        })
+
+    '''
+    POST /jobs
+        it will require the 'post:jobs' permission and the permission of the
+            operation itself (e.g. 'delete:movies' for purge-movies)
+        it will respond with a 400 error listing every invalid field before any database work
+        it will queue the job for the workers started with `flask run-jobs` (see jobs.py)
+        json body {"kind": kind, "params": params}, kind one of
+            import-actors, import-movies  {"rows": [<POST /actors or /movies body>, ...]}
+            purge-actors, purge-movies    {"ids": [<id>, ...]}
+            refresh-cast-summary          {}
+    returns status code 202 and json {"success": True, "jobs": job} where job an array containing only the queued job
+        or appropriate status code indicating reason for failure
+    '''
+    @app.route('/api/v1/jobs', methods=['POST'])
+    @requires_auth('post:jobs')
+    def post_job(payload):
+        kind, params = validate_job(get_body())
+        check_permissions(KINDS[kind].permission, payload)
+
+        job = enqueue(kind, params)
+        db.session.commit()
+        response = jsonify({
+            "success": True,
+            "jobs": [job.format()]
+        })
+        response.status_code = 202
+        response.headers['Location'] = f'/api/v1/jobs/{job.id}'
+        return response
+
+    '''
+    GET /jobs/<id>
+        where <id> is the existing job id
+        it will respond with a 404 error if <id> is not found
+        it will require the 'get:jobs' permission
+        it will contain the job.format() data representation; processed and
+            total grow as the job's rows are committed
+    returns status code 200 and json {"success": True, "jobs": job} where job an array containing only the job
+        or appropriate status code indicating reason for failure
+    '''
+    @app.route('/api/v1/jobs/<int:id>')
+    @requires_auth('get:jobs')
+    def get_job(payload, id):
+        job = db.session.get(Job, id)
+        if job is None:
+            abort(404)
+
+        return jsonify({
+            "success": True,
+            "jobs": [job.format()]
+        })
+
+    '''
+    flask run-jobs [--workers N]
+        runs queued jobs with N worker threads (JOBS_WORKERS) until stopped
+        start as many of these processes as needed; JOBS_MAX_RUNNING caps them all
+    '''
+    @app.cli.command('run-jobs')
+    @click.option('--workers', default=None, type=int, help='worker threads [default: JOBS_WORKERS]')
+    def run_jobs(workers):
+        run_workers(app, workers)
+
+    '''
+    flask partition-casts [--batch-size N] [--pause SECONDS] [--cancel]
+        opt-in: hash partitions casts on PostgreSQL, online (see partitioning.py)
+        prepares the partitioned copy, copies the rows in batches and swaps it in;
+        run it again to resume after an interruption
+        --cancel drops an unfinished conversion instead
+    '''
+    @app.cli.command('partition-casts')
+    @click.option('--batch-size', default=10000, show_default=True, type=int)
+    @click.option('--pause', default=0.0, show_default=True, type=float,
+                  help='seconds to sleep between batches')
+    @click.option('--cancel', is_flag=True, help='drop an unfinished conversion')
+    def partition_casts(batch_size, pause, cancel):
+        if db.engine.dialect.name != 'postgresql':
+            raise click.ClickException("casts is only partitioned on PostgreSQL")
+        state = partitioning.casts_state()
+        if cancel:
+            if state != 'copying':
+                raise click.ClickException("no conversion under way")
+            partitioning.cancel()
+            click.echo("conversion dropped; casts is unchanged")
+            return
+        if state == 'partitioned':
+            click.echo("casts is already partitioned")
+            return
+        if state == 'plain':
+            partitioning.prepare()
+            click.echo("casts_partitioned created; later writes to casts are mirrored into it")
+
+        def report(copied, estimate):
+            click.echo(f"copied {copied} of about {estimate} cast row(s)")
+
+        partitioning.copy_casts(batch_size, pause, report)
+        try:
+            partitioning.swap()
+        except partitioning.PartitioningError as error:
+            raise click.ClickException(str(error))
+        click.echo("casts is now hash partitioned")
+
+    '''
+    flask compact-changes [--tombstone-days N]
+        drops superseded change events and tombstones older than N days
+        intended to run periodically (e.g. a daily cron job)
+    '''
+    @app.cli.command('compact-changes')
+    @click.option('--tombstone-days', default=7, show_default=True, type=int)
+    def compact_changes(tombstone_days):
+        compaction = Change.compact(timedelta(days=tombstone_days))
+        click.echo(f"removed {compaction.removed} change(s); feed floor is cursor {compaction.floor}")
   
     """
     Error Handlers
@@ -323,6 +822,30 @@ def create_app(test_config=None):
             "message": "Method Not Allowed"
         }), 405
 
+    @app.errorhandler(409)
+    def conflict(error):
+        return jsonify({
+            "success": False,
+            "error": 409,
+            "message": "Conflict; The Resource Was Modified By Another Request"
+        }), 409
+
+    @app.errorhandler(410)
+    def gone(error):
+        return jsonify({
+            "success": False,
+            "error": 410,
+            "message": "Cursor Expired; Refetch The Full Listing"
+        }), 410
+
+    @app.errorhandler(415)
+    def unsupported_media_type(error):
+        return jsonify({
+            "success": False,
+            "error": 415,
+            "message": "Unsupported Media Type"
+        }), 415
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
@@ -331,6 +854,37 @@ def create_app(test_config=None):
             "message": "Unprocessable Entity"
         }), 422
 
+    @app.errorhandler(RateLimitExceeded)
+    def rate_limited(error):
+        response = jsonify({
+            "success": False,
+            "error": 429,
+            "message": error.description
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+        return response
+
+    @app.errorhandler(CoalesceTimeout)
+    def coalesce_timeout(error):
+        response = jsonify({
+            "success": False,
+            "error": 503,
+            "message": error.description
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+        return response
+
+    @app.errorhandler(ValidationError)
+    def invalid_body(error):
+        return jsonify({
+            "success": False,
+            "error": 400,
+            "message": "Bad Request",
+            "errors": error.errors
+        }), 400
+
     @app.errorhandler(AuthError)
     def auth_error(error):
         return jsonify({
@@ -341,7 +895,20 @@ def create_app(test_config=None):
 
     return app
 
-app = create_app()
+'''
+module level `app`
+    built on first access so `import app` stays free of side effects
+    while `gunicorn app:app` and `from app import app` keep working
+'''
+_app = None
+
+def __getattr__(name):
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=8080, debug=True)
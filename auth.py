@@ -1,14 +1,14 @@
-import os
 import json
-from flask import request, _request_ctx_stack
+import time
+from flask import request, current_app, _request_ctx_stack
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
 
+from ratelimit import get_limiter
 
-AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN'] # the auth0 domain
-ALGORITHMS = os.environ['ALGORITHMS']
-API_AUDIENCE = os.environ['API_AUDIENCE'] # the audience set for the auth0 app
+# AUTH0_DOMAIN, ALGORITHMS and API_AUDIENCE are read from current_app.config
+# on each verification so importing this module has no side effects
 
 ## AuthError Exception
 '''
@@ -88,6 +88,31 @@ def check_permissions(permission, payload):
         
     return True
 
+'''
+get_jwks(domain) method
+    @INPUTS
+        domain: the auth0 domain
+
+    it will return app.config['JWKS'] when set (e.g. locally minted keys in tests)
+    it will otherwise fetch https://{domain}/.well-known/jwks.json and cache it
+        on the app for JWKS_CACHE_SECONDS instead of fetching it on every request
+    return the json web key set
+'''
+def get_jwks(domain):
+    if current_app.config.get('JWKS'):
+        return current_app.config['JWKS']
+
+    cached = current_app.extensions.get('jwks')
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    jsonurl = urlopen(f'https://{domain}/.well-known/jwks.json')
+    jwks = json.loads(jsonurl.read())
+    current_app.extensions['jwks'] = (
+        time.monotonic() + current_app.config.get('JWKS_CACHE_SECONDS', 0), jwks
+    )
+    return jwks
+
 '''
 verify_decode_jwt(token) method
     @INPUTS
@@ -101,9 +126,12 @@ verify_decode_jwt(token) method
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 def verify_decode_jwt(token):
+    AUTH0_DOMAIN = current_app.config['AUTH0_DOMAIN'] # the auth0 domain
+    ALGORITHMS = current_app.config['ALGORITHMS']
+    API_AUDIENCE = current_app.config['API_AUDIENCE'] # the audience set for the auth0 app
+
     # GET THE PUBLIC KEY FROM AUTH0
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    jwks = get_jwks(AUTH0_DOMAIN)
 
     # GET THE DATA IN THE HEADER
     unverified_header = jwt.get_unverified_header(token)
@@ -167,6 +195,8 @@ def verify_decode_jwt(token):
     it will use the get_token_auth_header method to get the token
     it will use the verify_decode_jwt method to decode the jwt
     it will use the check_permissions method validate claims and check the requested permission
+    it will apply the rate limit and concurrency quota for the token's `sub` and permission
+        raising a RateLimitExceeded when the caller is throttled
     return the decorator which passes the decoded payload to the decorated method
 '''
 def requires_auth(permission=''):
@@ -176,6 +206,15 @@ def requires_auth(permission=''):
             token = get_token_auth_header()
             payload = verify_decode_jwt(token)
             check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+
+            limiter = get_limiter()
+            if limiter is None:
+                return f(payload, *args, **kwargs)
+
+            slot = limiter.check(payload, permission)
+            try:
+                return f(payload, *args, **kwargs)
+            finally:
+                limiter.release(slot)
         return wrapper
     return requires_auth_decorator
\ No newline at end of file
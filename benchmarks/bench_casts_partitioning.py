@@ -0,0 +1,141 @@
+"""
+casts partitioning benchmark (PostgreSQL)
+
+Builds a casts table of `rows` rows (50M by default, 10 actors per movie,
+about 100 movies per actor) in a scratch schema, three ways:
+    heap          the table before: a plain heap with its (movie_id, actor_id)
+                  primary key only
+    heap+index    the same heap with the (actor_id, movie_id) covering index,
+                  what the migrations ship (models.Cast)
+    partitioned   hash partitioned on movie_id, with both indexes, as left by
+                  `flask partition-casts` (partitioning.py)
+and times the queries casts serves: cast loads, shaped like the selectinload
+of GET /api/v1/movies (100 movies per query), the cast of one movie (its
+lazy load) and filmographies (Actor.movies, one actor). Each query runs for
+up to `seconds` seconds with random ids; the plan of one of them is
+summarized (node, heap fetches, buffers). The schema is dropped at the end.
+
+Run from the repository root against a scratch database:
+    python benchmarks/bench_casts_partitioning.py postgresql://localhost/bench [rows] [seconds]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from partitioning import CASTS_PARTITIONS  # noqa: E402
+
+SCHEMA = 'bench_casts'
+CAST_SIZE = 10
+MOVIES_PER_ACTOR = 100
+CAST_LOAD_MOVIES = 100
+
+CAST_LOAD = "SELECT movie_id, actor_id FROM {table} WHERE movie_id = ANY(:ids)"
+MOVIE_CAST = "SELECT actor_id FROM {table} WHERE movie_id = :id"
+FILMOGRAPHY = "SELECT movie_id FROM {table} WHERE actor_id = :id"
+
+
+def build(connection, rows):
+    movies = rows // CAST_SIZE
+    actors = max(rows // MOVIES_PER_ACTOR, CAST_SIZE)
+    connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    connection.execute(text(f"SET search_path TO {SCHEMA}"))
+
+    start = time.perf_counter()
+    connection.execute(text("CREATE TABLE heap (movie_id integer NOT NULL, actor_id integer NOT NULL)"))
+    # k * 104729 spreads a movie's cast over distinct actors
+    connection.execute(text(
+        "INSERT INTO heap SELECT m, (m::bigint * 7919 + k * 104729) % :actors + 1 "
+        "FROM generate_series(1, :movies) m, generate_series(0, :cast_size - 1) k"
+    ), {'movies': movies, 'actors': actors, 'cast_size': CAST_SIZE})
+    connection.execute(text("ALTER TABLE heap ADD PRIMARY KEY (movie_id, actor_id)"))
+    print(f"heap: {rows} rows in {time.perf_counter() - start:.0f} s")
+
+    start = time.perf_counter()
+    connection.execute(text(
+        "CREATE TABLE partitioned (movie_id integer NOT NULL, actor_id integer NOT NULL, "
+        "PRIMARY KEY (movie_id, actor_id)) PARTITION BY HASH (movie_id)"
+    ))
+    for remainder in range(CASTS_PARTITIONS):
+        connection.execute(text(
+            f"CREATE TABLE partitioned_p{remainder} PARTITION OF partitioned "
+            f"FOR VALUES WITH (MODULUS {CASTS_PARTITIONS}, REMAINDER {remainder})"
+        ))
+    connection.execute(text("CREATE INDEX ON partitioned (actor_id, movie_id)"))
+    connection.execute(text("INSERT INTO partitioned SELECT * FROM heap"))
+    print(f"partitioned: copied in {time.perf_counter() - start:.0f} s")
+
+    for table in ('heap', 'partitioned'):
+        connection.execute(text(f"VACUUM (ANALYZE) {table}"))
+    return movies, actors
+
+
+def plan_summary(connection, sql, params):
+    plan = connection.execute(text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql), params).scalar()[0]['Plan']
+    nodes, heap_fetches = set(), 0
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if 'Scan' in node['Node Type']:
+            nodes.add(node['Node Type'])
+        heap_fetches += node.get('Heap Fetches', 0)
+        pending.extend(node.get('Plans', ()))
+    buffers = plan['Shared Hit Blocks'] + plan['Shared Read Blocks']
+    return f"{'/'.join(sorted(nodes))}, {heap_fetches} heap fetches, {buffers} buffers"
+
+
+def measure(connection, sql, make_params, seconds):
+    timings = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline and len(timings) < 1000:
+        params = make_params()
+        start = time.perf_counter()
+        connection.execute(text(sql), params).fetchall()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return sum(timings) / len(timings) * 1e3, timings[len(timings) // 2] * 1e3, len(timings)
+
+
+def report(connection, label, table, movies, actors, seconds):
+    for name, sql, make_params in (
+            ('cast load', CAST_LOAD.format(table=table),
+             lambda: {'ids': random.sample(range(1, movies + 1), CAST_LOAD_MOVIES)}),
+            ('movie cast', MOVIE_CAST.format(table=table),
+             lambda: {'id': random.randint(1, movies)}),
+            ('filmography', FILMOGRAPHY.format(table=table),
+             lambda: {'id': random.randint(1, actors)})):
+        mean, median, runs = measure(connection, sql, make_params, seconds)
+        plan = plan_summary(connection, sql, make_params())
+        print(f"{label:>12} {name:>12} {mean:9.2f} ms mean {median:9.2f} ms median "
+              f"({runs} runs)  {plan}")
+
+
+def main(url, rows=50_000_000, seconds=5):
+    random.seed(42)
+    engine = create_engine(url, isolation_level='AUTOCOMMIT')
+    with engine.connect() as connection:
+        if connection.dialect.name != 'postgresql':
+            sys.exit('casts is only partitioned on PostgreSQL')
+        try:
+            movies, actors = build(connection, rows)
+            print(f"{movies} movies, {actors} actors; {CAST_LOAD_MOVIES} movies per cast load")
+
+            report(connection, 'heap', 'heap', movies, actors, seconds)
+            connection.execute(text("CREATE INDEX ON heap (actor_id, movie_id)"))
+            connection.execute(text("VACUUM (ANALYZE) heap"))
+            report(connection, 'heap+index', 'heap', movies, actors, seconds)
+            report(connection, 'partitioned', 'partitioned', movies, actors, seconds)
+        finally:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    main(sys.argv[1], *(int(arg) for arg in sys.argv[2:4]))
@@ -0,0 +1,106 @@
+"""
+Request coalescing benchmark
+
+A thundering herd: bursts of identical GET /api/v1/movies requests released
+together by a barrier against a SQLite catalog, with COALESCE_ENABLED off and
+on. Reports the SELECTs the database ran per burst and the burst's wall time.
+
+Run from the repository root:
+    python benchmarks/bench_coalescing.py [movies] [herd size]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db, Actor, Movie  # noqa: E402
+from testing import LocalSigner  # noqa: E402
+
+BURSTS = 5
+
+
+def build(enabled, database_url, signer):
+    return create_app({
+        'DATABASE_URL': database_url,
+        'RATELIMIT_ENABLED': False,
+        'STREAM_ENABLED': False,
+        'SLOW_QUERY_ENABLED': False,
+        'COALESCE_ENABLED': enabled,
+        **signer.config()
+    })
+
+
+def seed(app, movies):
+    with app.app_context():
+        db.create_all()
+        actors = [Actor(f'Actor {n}', 'female', date(1980, 1, 1)) for n in range(movies)]
+        db.session.add_all(actors)
+        for n in range(movies):
+            db.session.add(Movie(f'Movie {n}', date(2023, 1, 1), actors[n:n + 3]))
+        db.session.commit()
+
+
+def herd(app, size, headers):
+    barrier = threading.Barrier(size)
+    statuses = []
+
+    def request():
+        client = app.test_client()
+        barrier.wait()
+        statuses.append(client.get('/api/v1/movies', headers=headers).status_code)
+
+    threads = [threading.Thread(target=request) for _ in range(size)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert statuses == [200] * size, statuses
+    return elapsed
+
+
+def main(movies=2000, size=50):
+    signer = LocalSigner()
+    headers = {'Authorization': f'Bearer {signer.token()}'}
+    directory = tempfile.mkdtemp(prefix='bench_coalescing_')
+    database_url = 'sqlite:///' + os.path.join(directory, 'catalog.db')
+
+    print(f"{movies} movies, {BURSTS} bursts of {size} identical GET /api/v1/movies")
+    for enabled in (False, True):
+        app = build(enabled, database_url, signer)
+        if not enabled:
+            seed(app, movies)
+
+        selects = []
+        with app.app_context():
+            engine = db.engine
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                selects.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            herd(app, size, headers)  # warm up
+            del selects[:]
+            elapsed = sum(herd(app, size, headers) for _ in range(BURSTS))
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+            with app.app_context():
+                engine.dispose()
+
+        label = 'coalesced' if enabled else 'baseline '
+        print(f"{label}: {len(selects) / BURSTS:6.1f} SELECTs per burst  "
+              f"{elapsed / BURSTS * 1e3:8.1f} ms per burst")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,74 @@
+"""
+MessagePack benchmark
+
+Payload size and encode / decode time of JSON against MessagePack for movie
+lists shaped like GET /api/v1/movies, dates included. JSON is encoded the way
+jsonify() does it (Flask's encoder) and MessagePack the way
+negotiation.jsonify() does it (the date extension type). Sizes are also shown
+gzipped, as most responses leave compressed.
+
+Run from the repository root (needs `pip install msgpack`):
+    python benchmarks/bench_msgpack.py
+"""
+import gzip
+import json
+import os
+import sys
+import timeit
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask import json as flask_json  # noqa: E402
+
+import negotiation  # noqa: E402
+
+MOVIE_COUNTS = (50, 500, 5000)
+CAST_SIZE = 12
+
+
+def movie_list(count):
+    return {
+        'success': True,
+        'movies': [{
+            'id': m,
+            'title': f'Movie number {m}',
+            'release_date': date(2023, 7, 14),
+            'version': 1,
+            'cast': [{
+                'id': a,
+                'name': f'Actor number {a}',
+                'gender': 'female' if a % 2 else 'male',
+                'dob': date(1980, 1, 1),
+                'version': 1,
+            } for a in range(m % 40, m % 40 + CAST_SIZE)],
+        } for m in range(count)],
+    }
+
+
+def best_ms(fn):
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    return min(timer.repeat(3, loops)) / loops * 1e3
+
+
+def main():
+    if negotiation.msgpack is None:
+        sys.exit('msgpack is not installed: pip install msgpack')
+
+    app = Flask(__name__)
+    print(f"{'movies':>7} {'format':>8} {'bytes':>10} {'gzipped':>9} {'encode ms':>10} {'decode ms':>10}")
+    with app.app_context():
+        for count in MOVIE_COUNTS:
+            data = movie_list(count)
+            for name, encode, decode in (
+                    ('json', lambda: flask_json.dumps(data).encode('utf-8'), json.loads),
+                    ('msgpack', lambda: negotiation.packb(data), negotiation.unpackb)):
+                body = encode()
+                print(f"{count:>7} {name:>8} {len(body):>10} {len(gzip.compress(body, 6)):>9} "
+                      f"{best_ms(encode):>10.2f} {best_ms(lambda: decode(body)):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Rate limiter benchmark
+
+Per-request overhead of RateLimiter.check + release on the in-process
+MemoryBackend, single threaded and with threads hitting distinct subjects.
+
+Run from the repository root:
+    python benchmarks/bench_ratelimit.py
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from ratelimit import MemoryBackend, RateLimiter  # noqa: E402
+
+CALLS = 200000
+
+
+def run(limiter, subject, calls):
+    payload = {'sub': subject}
+    for _ in range(calls):
+        limiter.release(limiter.check(payload, 'get:movies'))
+
+
+def main():
+    app = Flask(__name__)
+    limiter = RateLimiter(MemoryBackend(), (1e9, 1e9), {}, 8)
+
+    with app.app_context():
+        start = time.perf_counter()
+        run(limiter, 'auth0|single', CALLS)
+        elapsed = time.perf_counter() - start
+    print(f"1 thread : {elapsed / CALLS * 1e6:.2f} us per check+release")
+
+    for count in (4, 16):
+        def worker(n):
+            with app.app_context():
+                run(limiter, f'auth0|{n}', CALLS // count)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"{count:2d} threads: {elapsed / CALLS * 1e6:.2f} us per check+release (wall)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Startup benchmark
+
+Measures, in a fresh interpreter per run:
+    import   - `import app`
+    factory  - create_app() with an explicit config
+    first    - time to the first (unauthenticated) request
+
+Run from the repository root:
+    python benchmarks/bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+application = app.create_app({
+    "DATABASE_URL": "sqlite://",
+    "AUTH0_DOMAIN": "example.auth0.com",
+    "ALGORITHMS": ["RS256"],
+    "API_AUDIENCE": "casting-agency",
+})
+t2 = time.perf_counter()
+application.test_client().get("/api/v1/actors")
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2)
+'''
+
+
+def main(runs=10):
+    env = dict(os.environ)
+    # the baseline tree needs these at import time; harmless afterwards
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env.setdefault("AUTH0_DOMAIN", "example.auth0.com")
+    env.setdefault("ALGORITHMS", "RS256")
+    env.setdefault("API_AUDIENCE", "casting-agency")
+
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+                             check=True, capture_output=True, text=True)
+        samples.append([float(v) for v in out.stdout.split()])
+
+    for i, label in enumerate(("import", "factory", "first")):
+        values = [s[i] * 1e3 for s in samples]
+        print(f"{label:8s} median {statistics.median(values):7.2f} ms  "
+              f"min {min(values):7.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,54 @@
+"""
+Request validation benchmark
+
+Per-request cost of Schema.validate for the write routes' bodies, valid and
+invalid, and of the cached date parser against uncached parsing.
+
+Run from the repository root:
+    python benchmarks/bench_validation.py
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation import (  # noqa: E402
+    ACTOR_CREATE, MOVIE_CREATE, MOVIE_UPDATE, ValidationError, cached_parse_date, parse_date
+)
+
+CALLS = 200000
+
+BODIES = (
+    ('POST /actors', ACTOR_CREATE, {'name': 'Tom Cruise', 'gender': 'male', 'dob': 'July 3, 1962'}),
+    ('POST /movies', MOVIE_CREATE, {'title': 'Heat', 'release_date': '1995-12-15', 'cast': list(range(1, 21))}),
+    ('PATCH /movies', MOVIE_UPDATE, {'title': 'Heat', 'version': 3}),
+    ('POST /actors invalid', ACTOR_CREATE, {'name': '', 'dob': 'someday'}),
+)
+
+
+def per_call(fn, calls=CALLS):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    for label, schema, body in BODIES:
+        def validate():
+            try:
+                schema.validate(body)
+            except ValidationError:
+                pass
+        print(f"{label:22s} {per_call(validate):6.2f} us per validate")
+
+    cached_parse_date.cache_clear()
+    print(f"{'cached parse_date':22s} {per_call(lambda: parse_date('July 3, 1962')):6.2f} us")
+    print(f"{'uncached strptime':22s} "
+          f"{per_call(lambda: datetime.strptime('July 3, 1962', '%B %d, %Y').date(), CALLS // 10):6.2f} us")
+
+
+if __name__ == '__main__':
+    main()
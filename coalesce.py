@@ -0,0 +1,127 @@
+import threading
+from functools import wraps
+
+from flask import Response, current_app, request
+
+from negotiation import negotiated_mimetype
+
+'''
+Request coalescing (single flight)
+
+When a popular listing expires from client caches, many identical GETs
+reach a worker at once. The first one (the leader) runs the view; the others
+arriving while it is in flight wait for it and get a copy of its serialized
+body, so the query and the serialization run once per burst instead of once
+per request.
+
+Requests are identical when they share the path, the query string, the
+negotiated format (json or MessagePack) and the caller's permissions (the
+permissions decide what a view may return, e.g. actor events in
+GET /api/v1/changes). An error raised by the leader,
+including an abort(404), is raised in every waiter as well. A waiter gives
+up after COALESCE_TIMEOUT seconds with a CoalesceTimeout.
+
+Waiters get the response as of the leader's query, which may have started
+just before they arrived; the same staleness a cache of a few milliseconds
+would give.
+'''
+
+
+'''
+CoalesceTimeout Exception
+    raised in a waiter whose leader did not finish within the timeout
+    create_app turns it into a 503 with Retry-After
+'''
+class CoalesceTimeout(Exception):
+    def __init__(self, description, retry_after):
+        self.description = description
+        self.retry_after = retry_after
+
+
+'''
+Call
+    one in-flight execution; waiters block on `done`
+'''
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+'''
+SingleFlight
+    the in-flight calls of a worker process, keyed by request identity
+    do(key, fn, timeout) runs fn unless an identical call is in flight,
+        in which case it waits up to timeout seconds for that call's result
+    return (result, shared) where shared tells a waiter from the leader
+'''
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, timeout):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                call.waiters += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as error:
+                call.error = error
+                raise
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+            return call.result, False
+
+        if not call.done.wait(timeout):
+            raise CoalesceTimeout('Identical Request Still In Flight', timeout)
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+
+'''
+@coalesced decorator method
+    placed below @requires_auth on read routes, so every request is still
+    authenticated and rate limited on its own
+    streaming responses must not be coalesced
+'''
+def coalesced(f):
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        flight = current_app.extensions.get('coalesce')
+        if flight is None:
+            return f(payload, *args, **kwargs)
+
+        key = (
+            request.path,
+            tuple(sorted(request.args.items(multi=True))),
+            negotiated_mimetype(),
+            tuple(sorted(payload.get('permissions', []))),
+        )
+
+        # the view's headers (Content-Type, ETag) are shared with the body
+        def run():
+            response = current_app.make_response(f(payload, *args, **kwargs))
+            return response.get_data(), response.status_code, response.headers.to_wsgi_list()
+
+        (body, status, headers), shared = flight.do(
+            key, run, current_app.config['COALESCE_TIMEOUT']
+        )
+        return Response(body, status=status, headers=headers)
+    return wrapper
+
+
+def setup_coalescing(app):
+    if app.config['COALESCE_ENABLED']:
+        app.extensions['coalesce'] = SingleFlight()
@@ -0,0 +1,201 @@
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import current_app, request
+
+# brotli and zstandard are optional; without them only gzip is offered
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = (
+    'application/json',
+    'application/msgpack',
+    'application/x-msgpack',
+    'text/plain',
+    'text/html',
+    'text/event-stream',
+)
+
+'''
+available_encodings()
+    return the content codings this process can produce, best ratio first
+    ties in the client's Accept-Encoding quality are broken in this order
+'''
+def available_encodings():
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+'''
+negotiate_encoding(accept_encodings)
+    @INPUTS
+        accept_encodings: werkzeug Accept object for the Accept-Encoding header
+
+    return the encoding with the highest client quality, or None for identity
+    (also when the client ranks identity above every encoding offered)
+'''
+def negotiate_encoding(accept_encodings):
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    if accept_encodings.quality('identity') > best_quality:
+        return None
+    return best
+
+
+'''
+compress(data, encoding, level)
+    one-shot compression of a complete body
+'''
+def compress(data, encoding, level):
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"unsupported encoding {encoding!r}")
+
+
+'''
+compress_stream(chunks, encoding, level)
+    incremental compression of a generator body
+    every chunk is flushed so a slow stream (e.g. server sent events)
+    reaches the client as it is produced instead of when the buffer fills
+'''
+def compress_stream(chunks, encoding, level):
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    elif encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    elif encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            yield compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        yield compressor.flush()
+    else:
+        raise ValueError(f"unsupported encoding {encoding!r}")
+
+
+'''
+CompressedBodyCache
+    a byte-bounded LRU of compressed bodies keyed by (encoding, level, digest)
+    identical bodies, e.g. an unchanged movie list served again, are hashed
+    (cheap) instead of compressed (expensive)
+'''
+class CompressedBodyCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+'''
+compress_response(response)
+    the compression step of create_app's after_request pipeline
+    it will leave the response untouched when
+        the client does not accept a supported encoding
+        the response is already encoded, not compressible or not a success
+        the body is smaller than COMPRESS_MIN_SIZE
+    return the (possibly compressed) response
+'''
+def compress_response(response):
+    config = current_app.config
+    if not config['COMPRESS_ENABLED']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if (response.status_code < 200 or response.status_code >= 300
+            or response.status_code == 204
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    level = config['COMPRESS_LEVELS'][encoding]
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    cache = current_app.extensions.get('compression_cache')
+    key = (encoding, level, hashlib.blake2b(data, digest_size=16).digest())
+    body = cache.get(key) if cache is not None else None
+    if body is None:
+        body = compress(data, encoding, level)
+        if cache is not None:
+            cache.put(key, body)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+'''
+setup_compression(app)
+    attaches the compressed body cache sized by COMPRESS_CACHE_BYTES
+'''
+def setup_compression(app):
+    max_bytes = app.config['COMPRESS_CACHE_BYTES']
+    if max_bytes:
+        app.extensions['compression_cache'] = CompressedBodyCache(max_bytes)
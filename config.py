@@ -0,0 +1,93 @@
+import os
+
+'''
+Config
+    the settings create_app(test_config) falls back to when no test_config is given
+    values are read from the environment when the app is created, never at import time
+'''
+ENV_KEYS = ('DATABASE_URL', 'AUTH0_DOMAIN', 'ALGORITHMS', 'API_AUDIENCE')
+
+'''
+DEFAULTS
+    tunables applied before the environment or test_config, which may override them
+'''
+DEFAULTS = {
+    # Auth0 key set; None fetches https://AUTH0_DOMAIN/.well-known/jwks.json
+    'JWKS': None,
+    'JWKS_CACHE_SECONDS': 600,
+
+    # response compression (see compression.py)
+    'COMPRESS_ENABLED': True,
+    'COMPRESS_MIN_SIZE': 1024,  # bytes; smaller bodies are not worth the cpu
+    'COMPRESS_LEVELS': {'gzip': 6, 'br': 5, 'zstd': 3},
+    'COMPRESS_CACHE_BYTES': 16 * 1024 * 1024,
+
+    # per token quotas (see ratelimit.py)
+    'RATELIMIT_ENABLED': True,
+    'RATELIMIT_DEFAULT': (10, 50),  # (requests per second, burst) per sub and permission
+    'RATELIMIT_PERMISSIONS': {},  # {'get:movies': (5, 20)} overrides the default
+    'RATELIMIT_CONCURRENCY': 8,  # in-flight requests per sub, 0 disables
+    'RATELIMIT_BACKEND': None,  # None is a MemoryBackend per process
+
+    # identical concurrent GETs share one execution (see coalesce.py)
+    'COALESCE_ENABLED': True,
+    'COALESCE_TIMEOUT': 10,  # seconds a request waits for an identical one in flight
+
+    # GET /api/v1/actors?ids= and /movies?ids= (and their POST /batch forms)
+    'BATCH_MAX_IDS': 1000,
+
+    # GET /api/v1/changes paging
+    'CHANGES_PAGE_SIZE': 100,
+    'CHANGES_MAX_PAGE_SIZE': 1000,
+
+    # slow query log (see slow_queries.py)
+    'SLOW_QUERY_ENABLED': True,
+    'SLOW_QUERY_THRESHOLD_MS': 200,
+    'SLOW_QUERY_EXPLAIN_RATE': 0.05,  # share of slow SELECTs whose plan is captured
+    'SLOW_QUERY_LOG_SIZE': 500,  # entries kept for GET /api/v1/admin/slow-queries
+
+    # background jobs (see jobs.py)
+    'JOBS_WORKERS': 2,  # worker threads per `flask run-jobs` process
+    'JOBS_MAX_RUNNING': 4,  # jobs running at once across every worker process
+    'JOBS_MAX_ATTEMPTS': 3,
+    'JOBS_BACKOFF': 10,  # seconds before the first retry, doubled for each further one
+    'JOBS_BACKOFF_MAX': 600,
+    'JOBS_BATCH_SIZE': 500,  # rows per committed chunk
+    'JOBS_POLL_INTERVAL': 1,  # seconds an idle worker waits before looking again
+    'JOBS_LEASE': 300,  # seconds without progress before a running job is claimed again
+
+    # GET /api/v1/stream (see stream.py)
+    'STREAM_ENABLED': True,
+    'STREAM_BUFFER_SIZE': 256,  # events queued per subscriber before it is dropped
+    'STREAM_HEARTBEAT': 15,  # seconds of silence before a heartbeat comment
+    'STREAM_POLL_INTERVAL': 5,  # seconds; broker re-checks the log even without a ring
+    'STREAM_BATCH_SIZE': 500,  # change rows the broker reads per query
+}
+
+
+'''
+normalize_database_url(url) method
+    heroku/render style "postgres://" urls are rejected by SQLAlchemy 1.4
+    return the url with the "postgresql://" scheme
+'''
+def normalize_database_url(url):
+    if url and url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+'''
+load_config(environ) method
+    @INPUTS
+        environ: mapping to read settings from (defaults to os.environ)
+
+    it will raise a KeyError if a required setting is missing
+    return a dict suitable for app.config.from_mapping
+'''
+def load_config(environ=None):
+    if environ is None:
+        environ = os.environ
+
+    config = {key: environ[key] for key in ENV_KEYS}
+    config['DATABASE_URL'] = normalize_database_url(config['DATABASE_URL'])
+    return config
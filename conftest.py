@@ -0,0 +1,9 @@
+import os
+
+from testing import generate_private_key
+
+
+def pytest_configure(config):
+    # one signing key per test session, inherited by pytest-xdist workers
+    if 'PYTEST_XDIST_WORKER' not in os.environ and 'TEST_SIGNING_KEY' not in os.environ:
+        os.environ['TEST_SIGNING_KEY'] = generate_private_key()
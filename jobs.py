@@ -0,0 +1,412 @@
+import json
+import os
+import signal
+import socket
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, select, text
+
+from models import db, bulk_delete, refresh_cast_summary, Actor, Movie, Job
+from validation import ACTOR_CREATE, MOVIE_CREATE, Schema, ValidationError, choice, id_list, list_of
+
+'''
+Background jobs
+
+Imports, purges and cast summary refreshes touch too many rows to run inside
+a request. POST /api/v1/jobs validates the operation, checks that the caller
+could run it directly, stores it as a queued row in the jobs table and answers
+202 at once; worker threads started with `flask run-jobs` (or
+`python manage.py jobs`) run it, and GET /api/v1/jobs/<id> reports its progress.
+
+The jobs table is the queue. A worker claims the oldest ready row with one
+conditional UPDATE (after a SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL),
+so any number of worker processes can share a database. At most
+JOBS_MAX_RUNNING jobs run at once across all of them, and JOBS_WORKERS
+threads per process: on PostgreSQL claims take turns on an advisory lock, so
+two workers can not both count the last free slot; SQLite runs one write
+transaction at a time anyway.
+
+Work is done in chunks of JOBS_BATCH_SIZE rows, each committed together with
+the job's progress: GET /api/v1/jobs/<id> sees processed grow as rows are
+processed, and an attempt that fails (or whose worker dies) leaves a
+checkpoint the retry resumes from. Failed attempts are retried after
+JOBS_BACKOFF seconds, doubled for each further attempt, up to
+JOBS_MAX_ATTEMPTS; a JobFailed error (bad input) is not retried.
+'''
+
+
+'''
+JobFailed Exception
+    raised by a job handler for failures a retry cannot fix
+'''
+class JobFailed(Exception):
+    def __init__(self, description):
+        self.description = description
+
+
+'''
+LeaseLost Exception
+    the job was claimed again by another worker (this one stalled for longer
+    than JOBS_LEASE); the stalled attempt stops without touching the row
+'''
+class LeaseLost(Exception):
+    pass
+
+
+'''
+Interrupted Exception
+    the worker pool is stopping; the job is queued again without spending
+    an attempt and resumes from its last committed chunk
+'''
+class Interrupted(Exception):
+    pass
+
+
+'''
+Kind
+    handler(context, params) does the work and returns the job's json result
+    schema validates params, at enqueue time and again when the job runs
+    permission is what the caller needs to run the same operation directly
+'''
+Kind = namedtuple('Kind', 'handler schema permission')
+
+KINDS = {}
+
+def job_kind(name, schema, permission):
+    def register(handler):
+        KINDS[name] = Kind(handler, schema, permission)
+        return handler
+    return register
+
+
+'''
+JobContext
+    handed to a job handler
+    chunks(items) yields the items in chunks of JOBS_BATCH_SIZE, skipping
+        those a previous attempt already processed; when the loop body
+        returns, the chunk's work is committed together with the progress
+'''
+class JobContext:
+    def __init__(self, job, worker, batch_size, stopping=None):
+        self.job_id = job.id
+        self.worker = worker
+        self.processed = job.processed
+        self.batch_size = batch_size
+        self.stopping = stopping
+
+    def chunks(self, items):
+        total = len(items)
+        self.report(total=total)
+        for start in range(self.processed, total, self.batch_size):
+            if self.stopping is not None and self.stopping.is_set():
+                raise Interrupted()
+            yield items[start:start + self.batch_size]
+            self.processed = min(start + self.batch_size, total)
+            self.report()
+
+    def report(self, **values):
+        jobs = Job.__table__
+        owned = db.session.execute(
+            jobs.update()
+            .where(and_(jobs.c.id == self.job_id, jobs.c.worker == self.worker))
+            .values(processed=self.processed, heartbeat_at=datetime.utcnow(), **values)
+        ).rowcount
+        if not owned:
+            raise LeaseLost()
+        db.session.commit()
+
+
+'''
+validate_job(body)
+    checks a POST /api/v1/jobs body, {"kind": ..., "params": {...}}
+    it will raise a ValidationError naming every invalid field, params
+        fields prefixed with "params."
+    return (kind name, params) with params as sent, so they stay json
+'''
+def validate_job(body):
+    JOB_CREATE.validate(body)
+    params = body.get('params', {})
+    try:
+        KINDS[body['kind']].schema.validate(params)
+    except ValidationError as error:
+        raise ValidationError({
+            'params' if name == 'body' else f'params.{name}': message
+            for name, message in error.errors.items()
+        })
+    return body['kind'], params
+
+
+'''
+enqueue(kind, params)
+    adds a queued job; the caller commits
+    return the Job
+'''
+def enqueue(kind, params):
+    # MessagePack bodies carry dates as dates; the params column is json
+    params = json.loads(json.dumps(params, default=lambda value: value.isoformat()))
+    job = Job(kind=kind, params=params, max_attempts=current_app.config['JOBS_MAX_ATTEMPTS'])
+    db.session.add(job)
+    return job
+
+
+JOBS_CLAIM_LOCK = 0x6a6f6273  # pg_advisory_xact_lock key
+
+'''
+claim(worker)
+    marks the oldest ready job as running for worker and commits
+    ready is queued and past its run_after, or running with a heartbeat older
+    than JOBS_LEASE (its worker died); nothing is claimed while
+    JOBS_MAX_RUNNING jobs are running
+    on PostgreSQL the claim holds JOBS_CLAIM_LOCK until it commits, so the
+    running count it checks includes every earlier claim
+    return the job id, or None
+'''
+def claim(worker):
+    config = current_app.config
+    jobs = Job.__table__
+    if db.session.connection().dialect.name == 'postgresql':
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': JOBS_CLAIM_LOCK})
+    now = datetime.utcnow()
+    abandoned = now - timedelta(seconds=config['JOBS_LEASE'])
+
+    ready = or_(
+        and_(jobs.c.status == 'queued', jobs.c.run_after <= now),
+        and_(jobs.c.status == 'running', jobs.c.heartbeat_at < abandoned)
+    )
+    running = (
+        select(func.count()).select_from(jobs)
+        .where(and_(jobs.c.status == 'running', jobs.c.heartbeat_at >= abandoned))
+        .scalar_subquery()
+    )
+
+    # SKIP LOCKED steps over a row a finishing attempt still holds;
+    # the conditional UPDATE re-checks the cap and the lease
+    candidate = db.session.execute(
+        select(jobs.c.id).where(ready)
+        .order_by(jobs.c.run_after, jobs.c.id).limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar()
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    claimed = db.session.execute(
+        jobs.update()
+        .where(and_(jobs.c.id == candidate, ready, running < config['JOBS_MAX_RUNNING']))
+        .values(status='running', worker=worker, attempts=jobs.c.attempts + 1,
+                started_at=now, heartbeat_at=now)
+    ).rowcount
+    db.session.commit()
+    return candidate if claimed else None
+
+
+'''
+backoff(attempts)
+    seconds to wait before retrying a job that failed its attempts-th attempt
+'''
+def backoff(attempts):
+    config = current_app.config
+    return min(config['JOBS_BACKOFF'] * 2 ** (attempts - 1), config['JOBS_BACKOFF_MAX'])
+
+
+'''
+run(job_id, worker, stopping)
+    runs a job claimed by worker and records how it ended
+    a failed attempt is queued again after backoff() unless it raised
+    JobFailed or was the last one
+'''
+def run(job_id, worker, stopping=None):
+    job = db.session.get(Job, job_id)
+    attempts = job.attempts
+    kind = KINDS.get(job.kind)
+    context = JobContext(job, worker, current_app.config['JOBS_BATCH_SIZE'], stopping)
+
+    try:
+        if attempts > job.max_attempts:
+            raise JobFailed('Abandoned By Its Worker')
+        if kind is None:
+            raise JobFailed('Unknown Job Kind')
+        result = kind.handler(context, kind.schema.validate(job.params))
+        db.session.commit()
+    except LeaseLost:
+        db.session.rollback()
+        return
+    except Interrupted:
+        db.session.rollback()
+        finish(job_id, worker, status='queued', attempts=attempts - 1,
+               run_after=datetime.utcnow(), worker=None)
+        return
+    except Exception as error:
+        db.session.rollback()
+        if isinstance(error, JobFailed):
+            message = error.description
+        else:
+            current_app.logger.exception('job %s attempt %s failed', job_id, attempts)
+            message = f'{type(error).__name__}: {error}'[:500]
+
+        if not isinstance(error, JobFailed) and attempts < job.max_attempts:
+            finish(job_id, worker, status='queued', error=message, worker=None,
+                   run_after=datetime.utcnow() + timedelta(seconds=backoff(attempts)))
+        else:
+            finish(job_id, worker, status='failed', error=message, finished_at=datetime.utcnow())
+        return
+
+    finish(job_id, worker, status='succeeded', result=result, error=None,
+           finished_at=datetime.utcnow())
+
+
+def finish(job_id, owner, **values):
+    jobs = Job.__table__
+    db.session.execute(
+        jobs.update()
+        .where(and_(jobs.c.id == job_id, jobs.c.worker == owner, jobs.c.status == 'running'))
+        .values(**values)
+    )
+    db.session.commit()
+
+
+'''
+run_next(app, worker, stopping)
+    claims and runs one job in the calling thread
+    return the id of the job it ran, or None when none was ready
+'''
+def run_next(app, worker, stopping=None):
+    with app.app_context():
+        try:
+            job_id = claim(worker)
+            if job_id is not None:
+                run(job_id, worker, stopping)
+            return job_id
+        finally:
+            db.session.remove()
+
+
+'''
+WorkerPool
+    `size` threads (JOBS_WORKERS by default) running jobs until stop()
+    an idle thread polls every JOBS_POLL_INTERVAL seconds
+    stop() lets each running job finish its current chunk, then queues it
+    again to resume later
+'''
+class WorkerPool:
+    def __init__(self, app, size=None):
+        self.app = app
+        self.size = size or app.config['JOBS_WORKERS']
+        self.name = f'{socket.gethostname()[:40]}:{os.getpid()}'
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for n in range(self.size):
+            thread = threading.Thread(
+                target=self.work, args=(f'{self.name}:{n}',), name=f'job-worker-{n}', daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self, worker):
+        interval = self.app.config['JOBS_POLL_INTERVAL']
+        while not self.stopping.is_set():
+            try:
+                job_id = run_next(self.app, worker, self.stopping)
+            except Exception:
+                self.app.logger.exception('job worker %s', worker)
+                job_id = None
+            if job_id is None:
+                self.stopping.wait(interval)
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+
+'''
+run_workers(app, size)
+    runs a WorkerPool in the foreground until SIGTERM or Ctrl-C
+'''
+def run_workers(app, size=None):
+    pool = WorkerPool(app, size)
+    signal.signal(signal.SIGTERM, lambda signum, frame: pool.stopping.set())
+    pool.start()
+    app.logger.info('%s job worker(s) started as %s', pool.size, pool.name)
+    try:
+        while not pool.stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    pool.stop()
+
+
+"""
+Job kinds
+"""
+
+@job_kind('import-actors', Schema(rows=list_of(ACTOR_CREATE, required=True)), 'post:actors')
+def import_actors(context, params):
+    rows = params['rows']
+    for chunk in context.chunks(rows):
+        db.session.add_all(Actor(**row) for row in chunk)
+    return {'imported': len(rows)}
+
+
+'''
+import-movies
+    rows are MOVIE_CREATE bodies; a cast id that is not an actor fails the
+    job (rows already imported stay)
+'''
+@job_kind('import-movies', Schema(rows=list_of(MOVIE_CREATE, required=True)), 'post:movies')
+def import_movies(context, params):
+    rows = params['rows']
+    for chunk in context.chunks(rows):
+        cast_ids = {id for row in chunk for id in row.get('cast', ())}
+        actors = {actor.id: actor for actor in Actor.query.filter(Actor.id.in_(cast_ids))}
+        unknown = cast_ids - actors.keys()
+        if unknown:
+            raise JobFailed(f'Unknown Actor Ids {sorted(unknown)}')
+        db.session.add_all(
+            Movie(row['title'], row['release_date'], [actors[id] for id in set(row.get('cast', ()))])
+            for row in chunk
+        )
+    return {'imported': len(rows)}
+
+
+'''
+purge-actors, purge-movies
+    bulk_delete in chunks, each leaving its tombstones in the change feed
+    the result counts the rows deleted by the attempt that finished
+'''
+def purge(context, model, ids):
+    deleted = 0
+    for chunk in context.chunks(ids):
+        deleted += bulk_delete(model, chunk)
+    return {'deleted': deleted}
+
+
+@job_kind('purge-actors', Schema(ids=id_list(required=True)), 'delete:actors')
+def purge_actors(context, params):
+    return purge(context, Actor, params['ids'])
+
+
+@job_kind('purge-movies', Schema(ids=id_list(required=True)), 'delete:movies')
+def purge_movies(context, params):
+    return purge(context, Movie, params['ids'])
+
+
+'''
+refresh-cast-summary
+    recomputes cast_count and cast_ids of every movie (see refresh_cast_summary)
+'''
+@job_kind('refresh-cast-summary', Schema(), 'patch:movies')
+def refresh_cast_summaries(context, params):
+    ids = [id for id, in db.session.query(Movie.id).order_by(Movie.id)]
+    for chunk in context.chunks(ids):
+        refresh_cast_summary(db.session, chunk)
+    return {'refreshed': len(ids)}
+
+
+# after the kinds above are registered
+JOB_CREATE = Schema(kind=choice(*KINDS, required=True))
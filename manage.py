@@ -3,11 +3,20 @@ from flask_migrate import Migrate, MigrateCommand
 
 from app import app
 from models import db
+from jobs import run_workers
 
 migrate = Migrate(app, db)
 manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
+
+# python manage.py jobs [--workers N]; the same as `flask run-jobs`
+@manager.option('-w', '--workers', dest='workers', type=int, default=None,
+                help='worker threads (defaults to JOBS_WORKERS)')
+def jobs(workers):
+    run_workers(app, workers)
+
+
 if __name__ == '__main__':
     manager.run()
\ No newline at end of file
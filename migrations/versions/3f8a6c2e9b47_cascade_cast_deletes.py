@@ -0,0 +1,37 @@
+"""Cascade deletes of movies and actors to their casts rows
+
+Revision ID: 3f8a6c2e9b47
+Revises: 9e7c3a5d1f02
+Create Date: 2026-10-19 09:12:04.381552
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8a6c2e9b47'
+down_revision = '9e7c3a5d1f02'
+branch_labels = None
+depends_on = None
+
+
+# PostgreSQL's default constraint names; lets SQLite's batch mode name the
+# unnamed foreign keys it reflects the same way
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+def upgrade():
+    with op.batch_alter_table('casts', naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('casts_movie_id_fkey', type_='foreignkey')
+        batch_op.drop_constraint('casts_actor_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('casts_movie_id_fkey', 'movies', ['movie_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_foreign_key('casts_actor_id_fkey', 'actors', ['actor_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    with op.batch_alter_table('casts', naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('casts_movie_id_fkey', type_='foreignkey')
+        batch_op.drop_constraint('casts_actor_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('casts_movie_id_fkey', 'movies', ['movie_id'], ['id'])
+        batch_op.create_foreign_key('casts_actor_id_fkey', 'actors', ['actor_id'], ['id'])
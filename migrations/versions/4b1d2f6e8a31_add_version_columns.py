@@ -0,0 +1,26 @@
+"""Add version columns for optimistic concurrency
+
+Revision ID: 4b1d2f6e8a31
+Revises: c593e17c9b74
+Create Date: 2026-10-18 10:12:04.118310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1d2f6e8a31'
+down_revision = 'c593e17c9b74'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('actors', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('movies', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('movies', 'version')
+    op.drop_column('actors', 'version')
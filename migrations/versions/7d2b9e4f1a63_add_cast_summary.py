@@ -0,0 +1,89 @@
+"""Add cast_count and cast_ids to movies, kept in sync with casts
+
+Revision ID: 7d2b9e4f1a63
+Revises: 3f8a6c2e9b47
+Create Date: 2026-10-19 11:48:26.904713
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2b9e4f1a63'
+down_revision = '3f8a6c2e9b47'
+branch_labels = None
+depends_on = None
+
+
+# PostgreSQL keeps the summary in sync with statement level triggers; SQLite
+# has no arrays and relies on the application (models.sync_cast_summary)
+CAST_SUMMARY_FUNCTION = """
+CREATE OR REPLACE FUNCTION refresh_movie_cast_summary() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    touched integer[] := '{}';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        touched := touched || ARRAY(SELECT DISTINCT movie_id FROM new_casts);
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        touched := touched || ARRAY(SELECT DISTINCT movie_id FROM old_casts);
+    END IF;
+    UPDATE movies SET (cast_ids, cast_count) = (
+        SELECT coalesce(array_agg(actor_id ORDER BY actor_id), '{}'), count(*)
+        FROM casts WHERE casts.movie_id = movies.id
+    )
+    WHERE id = ANY(touched);
+    RETURN NULL;
+END
+$$
+"""
+
+CAST_SUMMARY_TRIGGERS = (
+    "CREATE TRIGGER casts_summary_insert AFTER INSERT ON casts "
+    "REFERENCING NEW TABLE AS new_casts "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE refresh_movie_cast_summary()",
+    "CREATE TRIGGER casts_summary_update AFTER UPDATE ON casts "
+    "REFERENCING OLD TABLE AS old_casts NEW TABLE AS new_casts "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE refresh_movie_cast_summary()",
+    "CREATE TRIGGER casts_summary_delete AFTER DELETE ON casts "
+    "REFERENCING OLD TABLE AS old_casts "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE refresh_movie_cast_summary()",
+)
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.add_column('movies', sa.Column('cast_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column('movies', sa.Column('cast_ids', postgresql.ARRAY(sa.Integer()), server_default='{}', nullable=False))
+        op.execute("""
+            UPDATE movies SET (cast_ids, cast_count) = (
+                SELECT coalesce(array_agg(actor_id ORDER BY actor_id), '{}'), count(*)
+                FROM casts WHERE casts.movie_id = movies.id
+            )
+        """)
+        op.execute(CAST_SUMMARY_FUNCTION)
+        for statement in CAST_SUMMARY_TRIGGERS:
+            op.execute(statement)
+    else:
+        op.add_column('movies', sa.Column('cast_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column('movies', sa.Column('cast_ids', sa.JSON(), server_default='[]', nullable=False))
+        op.execute("""
+            UPDATE movies SET
+                cast_count = (SELECT count(*) FROM casts WHERE casts.movie_id = movies.id),
+                cast_ids = (SELECT json_group_array(actor_id) FROM (
+                    SELECT actor_id FROM casts WHERE casts.movie_id = movies.id ORDER BY actor_id
+                ))
+        """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name in ('casts_summary_insert', 'casts_summary_update', 'casts_summary_delete'):
+            op.execute(f"DROP TRIGGER {name} ON casts")
+        op.execute("DROP FUNCTION refresh_movie_cast_summary()")
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.drop_column('cast_ids')
+        batch_op.drop_column('cast_count')
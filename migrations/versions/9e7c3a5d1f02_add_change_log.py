@@ -0,0 +1,43 @@
+"""Add change log for the incremental change feed
+
+Revision ID: 9e7c3a5d1f02
+Revises: 4b1d2f6e8a31
+Create Date: 2026-10-18 14:37:51.620417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e7c3a5d1f02'
+down_revision = '4b1d2f6e8a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=16), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=8), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=True),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    op.create_index('ix_changes_entity', 'changes', ['entity', 'entity_id'], unique=False)
+    op.create_table('change_compactions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('floor', sa.Integer(), nullable=False),
+    sa.Column('removed', sa.Integer(), nullable=False),
+    sa.Column('ran_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('change_compactions')
+    op.drop_index('ix_changes_entity', table_name='changes')
+    op.drop_table('changes')
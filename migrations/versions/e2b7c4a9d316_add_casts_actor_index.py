@@ -0,0 +1,38 @@
+"""Add the (actor_id, movie_id) covering index to casts
+
+Revision ID: e2b7c4a9d316
+Revises: 5c1e8b3d7a94
+Create Date: 2026-10-19 16:21:37.540218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7c4a9d316'
+down_revision = '5c1e8b3d7a94'
+branch_labels = None
+depends_on = None
+
+
+# on PostgreSQL the index is built CONCURRENTLY, outside the migration's
+# transaction, so writes to casts go on while it builds; partitioning the
+# table is a separate, opt-in step (`flask partition-casts`)
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        op.create_index('ix_casts_actor_id_movie_id', 'casts', ['actor_id', 'movie_id'], unique=False)
+        return
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_casts_actor_id_movie_id', 'casts', ['actor_id', 'movie_id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        op.drop_index('ix_casts_actor_id_movie_id', table_name='casts')
+        return
+
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_casts_actor_id_movie_id', table_name='casts', postgresql_concurrently=True)
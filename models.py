@@ -1,29 +1,93 @@
-import os
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, ForeignKey, Integer, String, Date
-from sqlalchemy.orm import relationship
+from datetime import datetime, timedelta
+
+from sqlalchemy import ARRAY, DDL, JSON, Column, ForeignKey, Integer, String, Date, DateTime, Index, and_, bindparam, event, exists, func, literal, select, text
+from sqlalchemy.orm import aliased, relationship, validates
+from sqlalchemy.orm.attributes import PASSIVE_NO_INITIALIZE, flag_modified, get_history
 from flask_migrate import Migrate
 
-database_path = os.environ['DATABASE_URL']
-if database_path.startswith("postgres://"):
-  database_path = database_path.replace("postgres://", "postgresql://", 1)
+from config import normalize_database_url
+from slow_queries import setup_slow_query_log, time_statements
+from validation import parse_date as parse_date_strict
+
+"""
+HookedSQLAlchemy
+    flask_sqlalchemy's SQLAlchemy, calling every engine hook with each engine
+    it builds, on first use; engine events registered through a hook attach
+    to the app's engines only, not to every engine in the process (test and
+    benchmark engines included), and importing the models registers nothing
+"""
+class HookedSQLAlchemy(SQLAlchemy):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engine_hooks = []
+
+    def add_engine_hook(self, hook):
+        if hook not in self.engine_hooks:
+            self.engine_hooks.append(hook)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        for hook in self.engine_hooks:
+            hook(engine)
+        return engine
 
-db = SQLAlchemy()
+
+db = HookedSQLAlchemy()
+
+"""
+parse_date(value)
+    turns "YYYY-MM-DD" and "July 3, 1962" style strings into a date so every
+    backend (SQLite included) can store them; anything else is left for the
+    database to parse, as PostgreSQL does (routes reject it beforehand, see
+    validation.py)
+"""
+def parse_date(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return parse_date_strict(value)
+    except ValueError:
+        return value
 
 """
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    database_path defaults to app.config['DATABASE_URL']
+    the engine itself is only created on the first query, and gets the
+    engine hooks then: SQLite foreign keys, and the statement timing behind
+    the slow query log (slow_queries.py)
 """
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_path=None):
+    if database_path is None:
+        database_path = app.config["DATABASE_URL"]
+    app.config["SQLALCHEMY_DATABASE_URI"] = normalize_database_url(database_path)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
     migrate = Migrate(app, db)
+    db.add_engine_hook(enable_sqlite_foreign_keys)
+    db.add_engine_hook(time_statements)
+    setup_slow_query_log(app)
     # db.create_all() # auto updates database schema with changes described by models
     # NOTE: db.create_all() is an alternative approach to flask_migrate strategy
     # do not run flask_migrate with db.create_all()
 
+"""
+enable_sqlite_foreign_keys(engine)
+    SQLite ignores foreign keys, and so ON DELETE CASCADE, unless every
+    connection turns them on; engines of other databases are left alone
+"""
+def enable_sqlite_foreign_keys(engine):
+    if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', foreign_keys_on):
+        event.listen(engine, 'connect', foreign_keys_on)
+
+
+def foreign_keys_on(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
 """
 Actor
 
@@ -35,6 +99,14 @@ class Actor(db.Model):
     name = Column(String, nullable=False)
     gender = Column(String, nullable=False)
     dob = Column(Date, nullable=False)
+    version = Column(Integer, nullable=False, server_default='1')
+
+    # UPDATE ... WHERE version = <loaded version>; a stale row raises StaleDataError
+    __mapper_args__ = {'version_id_col': version}
+
+    @validates('dob')
+    def validate_dob(self, key, value):
+        return parse_date(value)
 
     def __init__(self, name, gender, dob):
         self.name = name
@@ -57,7 +129,8 @@ class Actor(db.Model):
             'id': self.id,
             'name': self.name,
             'gender': self.gender,
-            'dob': self.dob
+            'dob': self.dob,
+            'version': self.version
         }
 
 """
@@ -70,8 +143,20 @@ class Movie(db.Model):
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
     release_date = Column(Date, nullable=False)
-    cast = relationship('Actor', secondary="casts",
-                           backref=db.backref('movies', lazy=True))
+    version = Column(Integer, nullable=False, server_default='1')
+    # cast summary kept in sync with casts (see sync_cast_summary below)
+    cast_count = Column(Integer, nullable=False, default=0)
+    cast_ids = Column(ARRAY(Integer).with_variant(JSON(), 'sqlite'), nullable=False, default=list)
+    # casts rows go with their movie or actor through ON DELETE CASCADE,
+    # so deleting either never loads the collection on the other side
+    cast = relationship('Actor', secondary="casts", passive_deletes=True,
+                           backref=db.backref('movies', lazy=True, passive_deletes=True))
+
+    __mapper_args__ = {'version_id_col': version}
+
+    @validates('release_date')
+    def validate_release_date(self, key, value):
+        return parse_date(value)
 
     def __init__(self, title, release_date, cast):
         self.title = title
@@ -89,20 +174,546 @@ class Movie(db.Model):
         db.session.delete(self)
         db.session.commit()
 
+    '''
+    set_cast(actor_ids)
+        replaces the cast with one DELETE of the actors no longer cast and one
+        INSERT ... SELECT of the new ones, without loading the cast collection
+        the movie version is bumped when the cast changed
+    '''
+    def set_cast(self, actor_ids):
+        actor_ids = list(set(actor_ids))
+        casts = Cast.__table__
+
+        removed = db.session.execute(
+            casts.delete().where(and_(
+                casts.c.movie_id == self.id,
+                casts.c.actor_id.notin_(actor_ids)
+            ))
+        ).rowcount
+
+        added = 0
+        if actor_ids:
+            already_cast = exists().where(and_(
+                casts.c.movie_id == self.id,
+                casts.c.actor_id == Actor.id
+            ))
+            added = db.session.execute(
+                casts.insert().from_select(
+                    ['movie_id', 'actor_id'],
+                    select(literal(self.id), Actor.id)
+                    .where(Actor.id.in_(actor_ids))
+                    .where(~already_cast)
+                )
+            ).rowcount
+
+        if removed or added:
+            if has_cast_triggers(db.session):
+                # the cast lives in another table, so dirty the row to bump version
+                flag_modified(self, 'title')
+                db.session.expire(self, ['cast', *CAST_SUMMARY])
+            else:
+                # recomputed by the same UPDATE that bumps the version
+                self.cast_count, self.cast_ids = cast_summary_subqueries(self.id)
+                db.session.expire(self, ['cast'])
+
     def format(self):
         return {
             'id': self.id,
             'title': self.title,
             'release_date': self.release_date,
+            'version': self.version,
             'cast': [actor.format() for actor in self.cast]
         }
 
+    '''
+    format_compact()
+        the movies row alone, with the cast summary instead of the actors
+    '''
+    def format_compact(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'release_date': self.release_date,
+            'version': self.version,
+            'cast_count': self.cast_count,
+            'cast_ids': self.cast_ids
+        }
+
 """
 Cast
-
+    the primary key (movie_id, actor_id) answers a movie's cast and the
+    (actor_id, movie_id) index an actor's filmography, both from the index
+    alone; on PostgreSQL the table can be hash partitioned on movie_id
+    afterwards, as an opt-in (see partitioning.py)
 """
 class Cast(db.Model):
     __tablename__ = 'casts'
+    __table_args__ = (
+        Index('ix_casts_actor_id_movie_id', 'actor_id', 'movie_id'),
+    )
+
+    movie_id = Column(Integer, ForeignKey('movies.id', ondelete='CASCADE'), primary_key=True)
+    actor_id = Column(Integer, ForeignKey('actors.id', ondelete='CASCADE'), primary_key=True)
+
+
+"""
+cast summary triggers
+    on PostgreSQL every statement that changes casts recomputes cast_count
+    and cast_ids of the movies it touched, whatever issued it (the ORM, a
+    bulk delete, an ON DELETE CASCADE or psql); the migration creates the
+    same function and triggers, this DDL covers db.create_all()
+"""
+CAST_SUMMARY_FUNCTION = """
+CREATE OR REPLACE FUNCTION refresh_movie_cast_summary() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    touched integer[] := '{}';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        touched := touched || ARRAY(SELECT DISTINCT movie_id FROM new_casts);
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        touched := touched || ARRAY(SELECT DISTINCT movie_id FROM old_casts);
+    END IF;
+    UPDATE movies SET (cast_ids, cast_count) = (
+        SELECT coalesce(array_agg(actor_id ORDER BY actor_id), '{}'), count(*)
+        FROM casts WHERE casts.movie_id = movies.id
+    )
+    WHERE id = ANY(touched);
+    RETURN NULL;
+END
+$$
+"""
+
+CAST_SUMMARY_TRIGGERS = (
+    "CREATE TRIGGER casts_summary_insert AFTER INSERT ON casts "
+    "REFERENCING NEW TABLE AS new_casts "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE refresh_movie_cast_summary()",
+    "CREATE TRIGGER casts_summary_update AFTER UPDATE ON casts "
+    "REFERENCING OLD TABLE AS old_casts NEW TABLE AS new_casts "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE refresh_movie_cast_summary()",
+    "CREATE TRIGGER casts_summary_delete AFTER DELETE ON casts "
+    "REFERENCING OLD TABLE AS old_casts "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE refresh_movie_cast_summary()",
+)
+
+for statement in (CAST_SUMMARY_FUNCTION, *CAST_SUMMARY_TRIGGERS):
+    event.listen(Cast.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+"""
+Change
+    append-only change log (outbox) read by GET /api/v1/changes
+    one row per create/update/delete of an Actor or Movie, written by the
+    after_flush listener below in the same transaction as the change itself
+    cast edits bump the movie version, so they are logged as movie updates,
+    and so does losing an actor to a delete (see log_cast_movie_updates)
+    the row id is the cursor clients resume from; lock_change_log keeps ids
+    in commit order, so a reader never moves past an id still to be committed
+"""
+class Change(db.Model):
+    __tablename__ = 'changes'
+    # cursors must never be reused, even after compaction deletes the newest rows
+    __table_args__ = (
+        Index('ix_changes_entity', 'entity', 'entity_id'),
+        {'sqlite_autoincrement': True}
+    )
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String(16), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String(8), nullable=False)
+    version = Column(Integer)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def format(self):
+        return {
+            'cursor': self.id,
+            'entity': self.entity,
+            'id': self.entity_id,
+            'op': self.op,
+            'version': self.version,
+            'changed_at': self.changed_at
+        }
+
+    '''
+    compact(tombstone_ttl)
+        bounds the size of the log in two passes
+            every event superseded by a newer one for the same entity is dropped;
+            clients treat create/update as upserts, so this loses nothing
+            delete tombstones older than tombstone_ttl are dropped; that moves the
+            feed floor, and cursors below it must refetch the full listing
+        return the ChangeCompaction row describing the run
+    '''
+    @staticmethod
+    def compact(tombstone_ttl=timedelta(days=7)):
+        changes = Change.__table__
+        newer = aliased(Change)
+
+        superseded = db.session.execute(
+            changes.delete().where(
+                exists().where(and_(
+                    newer.entity == changes.c.entity,
+                    newer.entity_id == changes.c.entity_id,
+                    newer.id > changes.c.id
+                ))
+            )
+        ).rowcount
+
+        cutoff = datetime.utcnow() - tombstone_ttl
+        expired = and_(changes.c.op == 'delete', changes.c.changed_at < cutoff)
+        floor = db.session.execute(select(func.max(changes.c.id)).where(expired)).scalar()
+        tombstones = 0
+        if floor is not None:
+            tombstones = db.session.execute(changes.delete().where(expired)).rowcount
+
+        compaction = ChangeCompaction(
+            floor=max(floor or 0, ChangeCompaction.current_floor()),
+            removed=superseded + tombstones
+        )
+        db.session.add(compaction)
+        db.session.commit()
+        return compaction
+
+
+"""
+ChangeCompaction
+    one row per Change.compact() run; the highest floor is the oldest
+    cursor the feed can still answer without missing a tombstone
+"""
+class ChangeCompaction(db.Model):
+    __tablename__ = 'change_compactions'
+
+    id = Column(Integer, primary_key=True)
+    floor = Column(Integer, nullable=False)
+    removed = Column(Integer, nullable=False)
+    ran_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
-    movie_id = Column(Integer, ForeignKey('movies.id'), primary_key=True)
-    actor_id = Column(Integer, ForeignKey('actors.id'), primary_key=True)
+    @staticmethod
+    def current_floor():
+        return db.session.query(func.coalesce(func.max(ChangeCompaction.floor), 0)).scalar()
+
+
+CHANGE_LOGGED = {Actor: 'actor', Movie: 'movie'}
+
+"""
+lock_change_log(session)
+    taken before a transaction writes Change rows, and held until it ends
+    change ids come from a sequence, so two PostgreSQL transactions could
+    otherwise commit ids 8 then 7, and a reader that saw 8 first would move
+    its cursor past 7 for good; under the lock ids are handed out in commit
+    order (the lock is only released once the commit is visible)
+    SQLite already serializes its writers
+"""
+CHANGE_LOG_LOCK = 0x63686773  # pg_advisory_xact_lock key
+
+def lock_change_log(session):
+    if session.connection().dialect.name == 'postgresql':
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': CHANGE_LOG_LOCK})
+
+"""
+remember_versions(session, flush_context, instances)
+    before_flush hook that keeps the version of every dirty Actor/Movie
+    an UPDATE bumps it, which record_changes relies on: attributes assigned
+    SQL expressions (set_cast's cast summary) are expired by the flush and
+    no longer show up in is_modified
+"""
+@event.listens_for(db.session, 'before_flush')
+def remember_versions(session, flush_context, instances):
+    session.info['flushed_versions'] = {
+        obj: obj.__dict__.get('version') for obj in session.dirty if type(obj) in CHANGE_LOGGED
+    }
+
+"""
+record_changes(session, flush_context)
+    after_flush hook that appends Change rows for every Actor/Movie
+    inserted, updated or deleted by the flush
+    primary keys and new versions are known by now, and the insert
+    runs on the flush's connection, inside the same transaction
+"""
+@event.listens_for(db.session, 'after_flush')
+def record_changes(session, flush_context):
+    versions = session.info.pop('flushed_versions', {})
+    rows = []
+    for op, objects in (('create', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            entity = CHANGE_LOGGED.get(type(obj))
+            if entity is None:
+                continue
+            if (op == 'update' and not session.is_modified(obj, include_collections=False)
+                    and obj.__dict__.get('version') == versions.get(obj)):
+                continue
+            rows.append({
+                'entity': entity,
+                'entity_id': obj.id,
+                'op': op,
+                'version': obj.__dict__.get('version'),
+                'changed_at': datetime.utcnow()
+            })
+    if rows:
+        lock_change_log(session)
+        session.execute(Change.__table__.insert(), rows)
+        # read by the live stream's doorbell (stream.py)
+        session.info['changes_logged'] = True
+
+
+"""
+cast summary fallback
+    databases without the triggers above (SQLite) keep cast_count and
+    cast_ids in sync from the application instead, one UPDATE per change:
+        new movies get their summary computed before the INSERT
+        set_cast recomputes it in the UPDATE that bumps the movie version
+        bulk_delete calls sync_cast_summary before deleting actors
+        the flush hooks below cover other ORM cast edits, and deleted actors,
+        whose casts rows are removed by ON DELETE CASCADE: their movies are
+        recomputed just before the DELETE, without the deleted actors
+    on every database, Movie objects already loaded in the session get their
+    summary expired, so it is read back as the triggers or the fallback left it
+"""
+CAST_SUMMARY = ('cast_count', 'cast_ids')
+
+SQLITE_CAST_SUMMARY = """
+UPDATE movies SET
+    cast_count = (SELECT count(*) FROM casts WHERE casts.movie_id = movies.id {without}),
+    cast_ids = (SELECT json_group_array(actor_id) FROM (
+        SELECT actor_id FROM casts WHERE casts.movie_id = movies.id {without} ORDER BY actor_id
+    ))
+WHERE movies.id IN {movies}
+"""
+
+def cast_summary_subqueries(movie_id):
+    return (
+        text("(SELECT count(*) FROM casts WHERE movie_id = :summary_movie_id)")
+        .bindparams(summary_movie_id=movie_id),
+        text("(SELECT json_group_array(actor_id) FROM ("
+             "SELECT actor_id FROM casts WHERE movie_id = :summary_movie_id ORDER BY actor_id))")
+        .bindparams(summary_movie_id=movie_id),
+    )
+
+
+def has_cast_triggers(session):
+    return session.connection().dialect.name == 'postgresql'
+
+
+def sync_cast_summary(session, movie_ids=(), deleted_actor_ids=()):
+    if has_cast_triggers(session):
+        return
+    if deleted_actor_ids:
+        statement = text(SQLITE_CAST_SUMMARY.format(
+            without='AND casts.actor_id NOT IN :actor_ids',
+            movies='(SELECT movie_id FROM casts WHERE actor_id IN :actor_ids)'
+        )).bindparams(bindparam('actor_ids', list(deleted_actor_ids), expanding=True))
+    elif movie_ids:
+        statement = text(SQLITE_CAST_SUMMARY.format(without='', movies=':movie_ids')).bindparams(
+            bindparam('movie_ids', list(movie_ids), expanding=True))
+    else:
+        return
+    session.execute(statement)
+
+
+'''
+expire_cast_summary(session, movie_ids, attributes)
+    movie_ids None expires the summary of every Movie in the session
+'''
+def expire_cast_summary(session, movie_ids=None, attributes=CAST_SUMMARY):
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Movie) and (movie_ids is None or obj.id in movie_ids):
+            session.expire(obj, attributes)
+
+
+'''
+log_cast_movie_updates(session, actor_ids)
+    called before actors are deleted: ON DELETE CASCADE takes them out of
+    their movies' casts, which is a cast edit like any other, so those movies
+    get their version bumped and an update logged, one UPDATE and one
+    INSERT ... SELECT whatever the number of movies
+    return whether any movie was touched; their loaded version is then stale
+'''
+def log_cast_movie_updates(session, actor_ids):
+    casts = Cast.__table__
+    movies = Movie.__table__
+    cast_movies = select(casts.c.movie_id).where(casts.c.actor_id.in_(actor_ids))
+
+    touched = session.execute(
+        movies.update().where(movies.c.id.in_(cast_movies)).values(version=movies.c.version + 1)
+    ).rowcount
+    if not touched:
+        return False
+
+    lock_change_log(session)
+    session.execute(
+        Change.__table__.insert().from_select(
+            ['entity', 'entity_id', 'op', 'version', 'changed_at'],
+            select(literal('movie'), movies.c.id, literal('update'), movies.c.version,
+                   literal(datetime.utcnow()))
+            .where(movies.c.id.in_(cast_movies))
+        )
+    )
+    # read by the live stream's doorbell (stream.py)
+    session.info['changes_logged'] = True
+    return True
+
+
+@event.listens_for(db.session, 'before_flush')
+def summarize_flushed_casts(session, flush_context, instances):
+    for obj in session.new:
+        if isinstance(obj, Movie):
+            actor_ids = [actor.id for actor in obj.cast]
+            if None not in actor_ids:
+                obj.cast_ids = sorted(actor_ids)
+                obj.cast_count = len(actor_ids)
+
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Actor)]
+    if deleted:
+        if log_cast_movie_updates(session, deleted):
+            session.info['movie_versions_bumped'] = True
+        sync_cast_summary(session, deleted_actor_ids=deleted)
+        session.info['cast_expire_all'] = True
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_flushed_casts(session, flush_context):
+    changed = session.info.setdefault('cast_changed', set())
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Movie):
+            if obj in session.new:
+                # summarized before the flush unless its actors were new too
+                stale = obj.cast_count != len(obj.cast)
+            else:
+                # never loads a collection just to find out it did not change
+                stale = get_history(obj, 'cast', PASSIVE_NO_INITIALIZE).has_changes()
+            if stale:
+                changed.add(obj.id)
+        elif isinstance(obj, Actor):
+            history = get_history(obj, 'movies', PASSIVE_NO_INITIALIZE)
+            changed.update(movie.id for movie in list(history.added or ()) + list(history.deleted or ()))
+    sync_cast_summary(session, changed)
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def expire_flushed_casts(session, flush_context):
+    changed = session.info.pop('cast_changed', set())
+    if session.info.pop('movie_versions_bumped', False):
+        expire_cast_summary(session, attributes=('version', *CAST_SUMMARY))
+    if session.info.pop('cast_expire_all', False):
+        changed = None
+    if changed is None or changed:
+        expire_cast_summary(session, changed)
+
+
+"""
+bulk_delete(model, ids)
+    deletes every Actor or Movie whose id is in ids without loading them:
+    per chunk of BULK_DELETE_CHUNK ids, one INSERT ... SELECT writes the delete
+    tombstones to the change log and one DELETE removes the rows, their casts
+    going with them through ON DELETE CASCADE; the movies of deleted actors
+    are logged as updated first (log_cast_movie_updates)
+    the caller commits
+    return the number of rows deleted
+"""
+BULK_DELETE_CHUNK = 1000
+
+def bulk_delete(model, ids):
+    ids = list(ids)
+    table = model.__table__
+    changes = Change.__table__
+    deleted = 0
+    movies_touched = False
+    for start in range(0, len(ids), BULK_DELETE_CHUNK):
+        chunk = ids[start:start + BULK_DELETE_CHUNK]
+        if model is Actor:
+            movies_touched |= log_cast_movie_updates(db.session, chunk)
+            sync_cast_summary(db.session, deleted_actor_ids=chunk)
+        lock_change_log(db.session)
+        db.session.execute(
+            changes.insert().from_select(
+                ['entity', 'entity_id', 'op', 'version', 'changed_at'],
+                select(literal(CHANGE_LOGGED[model]), table.c.id, literal('delete'),
+                       table.c.version, literal(datetime.utcnow()))
+                .where(table.c.id.in_(chunk))
+            )
+        )
+        deleted += db.session.execute(table.delete().where(table.c.id.in_(chunk))).rowcount
+    if deleted:
+        # read by the live stream's doorbell (stream.py)
+        db.session.info['changes_logged'] = True
+        if model is Actor:
+            expire_cast_summary(db.session)
+    if movies_touched:
+        expire_cast_summary(db.session, attributes=('version',))
+    return deleted
+
+
+"""
+refresh_cast_summary(session, movie_ids)
+    recomputes cast_count and cast_ids of the listed movies from casts, on
+    every database; repairs summaries written around the triggers or the
+    fallback (e.g. by a restore that disabled triggers)
+"""
+POSTGRES_CAST_SUMMARY = """
+UPDATE movies SET (cast_ids, cast_count) = (
+    SELECT coalesce(array_agg(actor_id ORDER BY actor_id), '{}'), count(*)
+    FROM casts WHERE casts.movie_id = movies.id
+)
+WHERE movies.id IN :movie_ids
+"""
+
+def refresh_cast_summary(session, movie_ids):
+    if has_cast_triggers(session):
+        statement = text(POSTGRES_CAST_SUMMARY)
+    else:
+        statement = text(SQLITE_CAST_SUMMARY.format(without='', movies=':movie_ids'))
+    session.execute(statement.bindparams(bindparam('movie_ids', list(movie_ids), expanding=True)))
+    expire_cast_summary(session, set(movie_ids))
+
+
+"""
+Job
+    a catalog operation queued by POST /api/v1/jobs and run by the worker
+    pool (see jobs.py); the row is the queue entry, the lock and the progress
+    report at once
+        status moves queued -> running -> succeeded or failed; a failed
+        attempt goes back to queued with run_after pushed out (backoff)
+        processed is committed with each chunk of work, so a retried job
+        resumes where the last attempt stopped
+        heartbeat_at is refreshed on progress; a running job whose worker
+        stopped refreshing it for JOBS_LEASE seconds is claimed again
+"""
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(32), nullable=False)
+    params = Column(JSON, nullable=False)
+    status = Column(String(16), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    processed = Column(Integer, nullable=False, default=0)
+    total = Column(Integer)
+    result = Column(JSON)
+    error = Column(String)
+    worker = Column(String(64))
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def format(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'processed': self.processed,
+            'total': self.total,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'run_after': self.run_after,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
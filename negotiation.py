@@ -0,0 +1,114 @@
+import struct
+from datetime import date, datetime, timezone
+
+from flask import abort, current_app, has_request_context, request
+from flask import jsonify as json_response
+
+# msgpack is optional; without it every response is json
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+'''
+Content negotiation
+
+Bulk consumers spend most of their time encoding and decoding json. A client
+sending `Accept: application/msgpack` gets MessagePack instead, from every
+route and error handler, since create_app answers through jsonify() below;
+write routes accept a MessagePack body when its Content-Type says so.
+
+Dates travel as extension type 1, the signed days since 1970-01-01 in four
+bytes (6 bytes on the wire against 31 for json's "Fri, 14 Jul 2023 00:00:00
+GMT"); datetimes, which are naive UTC in the models, as the standard
+MessagePack timestamp (extension type -1).
+'''
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+DATE_EXT = 1
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def encode_default(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(value)
+    if isinstance(value, date):
+        return msgpack.ExtType(DATE_EXT, struct.pack('>i', value.toordinal() - EPOCH_ORDINAL))
+    raise TypeError(f'{type(value).__name__} is not MessagePack serializable')
+
+
+'''
+decode_ext(code, data)
+    it will raise a ValueError for extension types other than dates, so a
+    body can only carry values the routes know how to validate
+'''
+def decode_ext(code, data):
+    if code == DATE_EXT and len(data) == 4:
+        return date.fromordinal(EPOCH_ORDINAL + struct.unpack('>i', data)[0])
+    raise ValueError(f'unsupported MessagePack extension type {code}')
+
+
+def packb(data):
+    return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+def unpackb(data):
+    return msgpack.unpackb(data, ext_hook=decode_ext, timestamp=3, raw=False)
+
+
+'''
+negotiated_mimetype()
+    return the response mimetype the client prefers, json unless it asked
+    for MessagePack (and msgpack is installed)
+'''
+def negotiated_mimetype():
+    if msgpack is None or not has_request_context():
+        return 'application/json'
+    return request.accept_mimetypes.best_match(
+        ('application/json',) + MSGPACK_MIMETYPES, default='application/json'
+    )
+
+
+'''
+jsonify(*args, **kwargs)
+    flask.jsonify answering in the negotiated format
+'''
+def jsonify(*args, **kwargs):
+    mimetype = negotiated_mimetype()
+    if mimetype == 'application/json':
+        return json_response(*args, **kwargs)
+
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    data = args[0] if len(args) == 1 else args or kwargs
+    return current_app.response_class(packb(data), mimetype=mimetype)
+
+
+'''
+get_body()
+    request.get_json(silent=True) for json and MessagePack bodies
+    it will abort with 415 for a MessagePack body when msgpack is not installed
+    return the decoded body, or None if it is missing or malformed
+'''
+def get_body():
+    if request.mimetype not in MSGPACK_MIMETYPES:
+        return request.get_json(silent=True)
+    if msgpack is None:
+        abort(415)
+    try:
+        return unpackb(request.get_data(cache=True))
+    except (ValueError, struct.error):
+        return None
+
+
+'''
+vary_on_accept(response)
+    json and MessagePack responses differ by Accept once msgpack is installed
+'''
+def vary_on_accept(response):
+    if msgpack is not None and response.mimetype in ('application/json',) + MSGPACK_MIMETYPES:
+        response.vary.add('Accept')
+    return response
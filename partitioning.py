@@ -0,0 +1,260 @@
+import re
+import time
+
+from sqlalchemy import text
+
+from models import db, CAST_SUMMARY_TRIGGERS
+
+'''
+Partitioning casts (PostgreSQL, opt-in)
+
+casts grows fastest and is read by every Movie.format() and Actor.movies.
+The migrations only give it the (actor_id, movie_id) covering index next to
+its (movie_id, actor_id) primary key, so both directions are index-only scans.
+
+Hash partitioning it on movie_id (CASTS_PARTITIONS partitions) is a separate
+choice: each partition is vacuumed and indexed on its own, but a batched cast
+load (the selectinload behind GET /api/v1/movies) spans every partition and
+gets slower (see the README). `flask partition-casts` converts an existing
+database online:
+    prepare
+        creates the empty casts_partitioned and triggers that mirror every
+        later write to casts into it
+    copy
+        copies the existing rows in batches, in primary key order; each batch
+        commits with its position in casts_copy_progress, so an interrupted
+        run resumes where it stopped
+    swap
+        swaps casts_partitioned in for casts under a brief exclusive lock and
+        drops the old table
+`flask partition-casts --cancel` drops an unfinished conversion instead.
+'''
+CASTS_PARTITIONS = 16
+
+# the tables a conversion adds, which the models do not describe;
+# migrations/env.py keeps autogenerate from dropping them
+PARTITIONING_TABLE = re.compile(r'casts_(p\d+|partitioned|copy_progress)$')
+
+
+class PartitioningError(Exception):
+    pass
+
+
+# every write to casts during the copy lands in casts_partitioned as well,
+# so the copy only has to read the rows that existed before prepare()
+MIRROR_FUNCTION = """
+CREATE OR REPLACE FUNCTION mirror_casts_to_partitioned() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        DELETE FROM casts_partitioned
+        USING old_casts
+        WHERE casts_partitioned.movie_id = old_casts.movie_id
+          AND casts_partitioned.actor_id = old_casts.actor_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO casts_partitioned (movie_id, actor_id)
+        SELECT movie_id, actor_id FROM new_casts
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+MIRROR_TRIGGERS = (
+    "CREATE TRIGGER casts_mirror_insert AFTER INSERT ON casts "
+    "REFERENCING NEW TABLE AS new_casts "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE mirror_casts_to_partitioned()",
+    "CREATE TRIGGER casts_mirror_update AFTER UPDATE ON casts "
+    "REFERENCING OLD TABLE AS old_casts NEW TABLE AS new_casts "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE mirror_casts_to_partitioned()",
+    "CREATE TRIGGER casts_mirror_delete AFTER DELETE ON casts "
+    "REFERENCING OLD TABLE AS old_casts "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE mirror_casts_to_partitioned()",
+)
+
+'''
+COPY_BATCH
+    copies the next batch of casts after the saved position and saves the
+    new position in the same statement
+    FOR KEY SHARE makes a concurrent delete of a batch row wait for the batch
+    to commit, so the mirror trigger then deletes the copy too
+'''
+COPY_BATCH = """
+WITH batch AS (
+    SELECT movie_id, actor_id FROM casts
+    WHERE (movie_id, actor_id) > (
+        SELECT last_movie_id, last_actor_id FROM casts_copy_progress
+    )
+    ORDER BY movie_id, actor_id
+    LIMIT :batch_size
+    FOR KEY SHARE
+), inserted AS (
+    INSERT INTO casts_partitioned (movie_id, actor_id)
+    SELECT movie_id, actor_id FROM batch
+    ON CONFLICT DO NOTHING
+)
+UPDATE casts_copy_progress SET
+    last_movie_id = last.movie_id,
+    last_actor_id = last.actor_id,
+    copied = copied + last.rows
+FROM (
+    SELECT movie_id, actor_id, count(*) OVER () AS rows
+    FROM batch ORDER BY movie_id DESC, actor_id DESC LIMIT 1
+) AS last
+RETURNING last.rows
+"""
+
+
+'''
+casts_state()
+    return 'plain', 'copying' (prepare() ran, swap() did not) or 'partitioned'
+'''
+def casts_state():
+    partitioned, copying = db.session.execute(text("""
+        SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'casts'::regclass),
+               to_regclass('casts_partitioned') IS NOT NULL
+    """)).one()
+    if partitioned:
+        return 'partitioned'
+    return 'copying' if copying else 'plain'
+
+
+'''
+prepare()
+    creates casts_partitioned, its partitions and indexes, the copy position
+    and the mirror triggers, and commits
+'''
+def prepare():
+    db.session.execute(text("""
+        CREATE TABLE casts_partitioned (
+            movie_id integer NOT NULL REFERENCES movies(id) ON DELETE CASCADE,
+            actor_id integer NOT NULL REFERENCES actors(id) ON DELETE CASCADE,
+            CONSTRAINT casts_partitioned_pkey PRIMARY KEY (movie_id, actor_id)
+        ) PARTITION BY HASH (movie_id)
+    """))
+    for remainder in range(CASTS_PARTITIONS):
+        db.session.execute(text(
+            f"CREATE TABLE casts_p{remainder} PARTITION OF casts_partitioned "
+            f"FOR VALUES WITH (MODULUS {CASTS_PARTITIONS}, REMAINDER {remainder})"
+        ))
+    db.session.execute(text(
+        "CREATE INDEX ix_casts_partitioned_actor_id_movie_id ON casts_partitioned (actor_id, movie_id)"
+    ))
+
+    # one row: the primary key of the last row copied
+    db.session.execute(text("""
+        CREATE TABLE casts_copy_progress (
+            id integer PRIMARY KEY,
+            last_movie_id integer NOT NULL,
+            last_actor_id integer NOT NULL,
+            copied bigint NOT NULL,
+            finished_at timestamp
+        )
+    """))
+    db.session.execute(text("INSERT INTO casts_copy_progress VALUES (1, 0, 0, 0, NULL)"))
+
+    db.session.execute(text(MIRROR_FUNCTION))
+    for statement in MIRROR_TRIGGERS:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+'''
+copy_casts_batch(batch_size)
+    copies and commits one batch
+    return the number of rows read from casts; 0 once the copy has finished,
+    which is then recorded in casts_copy_progress
+'''
+def copy_casts_batch(batch_size):
+    rows = db.session.execute(text(COPY_BATCH), {'batch_size': batch_size}).scalar()
+    if rows is None:
+        db.session.execute(text(
+            "UPDATE casts_copy_progress SET finished_at = now() WHERE finished_at IS NULL"
+        ))
+        rows = 0
+    db.session.commit()
+    return rows
+
+
+'''
+copy_progress()
+    return (rows copied, rows in casts as estimated by the planner)
+'''
+def copy_progress():
+    copied = db.session.execute(text("SELECT copied FROM casts_copy_progress")).scalar()
+    estimate = db.session.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'casts'::regclass")
+    ).scalar()
+    db.session.commit()
+    return copied, max(estimate, 0)
+
+
+'''
+copy_casts(batch_size, pause, report, vacuum)
+    runs copy_casts_batch until the copy has finished, sleeping pause seconds
+    between batches to leave the database room for regular traffic
+    report(copied, estimate) is called after every batch
+    then vacuums casts_partitioned, which sets the visibility map that
+    index-only scans rely on (VACUUM needs a connection of its own, outside
+    any transaction)
+'''
+def copy_casts(batch_size, pause=0, report=None, vacuum=True):
+    while copy_casts_batch(batch_size):
+        if report is not None:
+            report(*copy_progress())
+        if pause:
+            time.sleep(pause)
+
+    if vacuum:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text("VACUUM (ANALYZE) casts_partitioned"))
+
+
+'''
+swap()
+    swaps casts_partitioned in for casts and commits; the cast summary
+    triggers move along
+    it will raise a PartitioningError before the copy has finished
+'''
+def swap():
+    finished = db.session.execute(
+        text("SELECT finished_at IS NOT NULL FROM casts_copy_progress")
+    ).scalar()
+    if not finished:
+        db.session.rollback()
+        raise PartitioningError("casts has not been copied yet")
+
+    # writers wait for the few statements below; the rows are all copied
+    # and the mirror triggers kept them in sync since
+    for statement in (
+            "LOCK TABLE casts IN ACCESS EXCLUSIVE MODE",
+            "DROP TABLE casts",
+            "DROP FUNCTION mirror_casts_to_partitioned()",
+            "DROP TABLE casts_copy_progress",
+            "ALTER TABLE casts_partitioned RENAME TO casts",
+            "ALTER TABLE casts RENAME CONSTRAINT casts_partitioned_pkey TO casts_pkey",
+            "ALTER TABLE casts RENAME CONSTRAINT casts_partitioned_movie_id_fkey TO casts_movie_id_fkey",
+            "ALTER TABLE casts RENAME CONSTRAINT casts_partitioned_actor_id_fkey TO casts_actor_id_fkey",
+            "ALTER INDEX ix_casts_partitioned_actor_id_movie_id RENAME TO ix_casts_actor_id_movie_id",
+            *CAST_SUMMARY_TRIGGERS):
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+'''
+cancel()
+    drops an unfinished conversion (casts_partitioned, the copy position and
+    the mirror triggers) and commits; casts itself is left as it was
+'''
+def cancel():
+    for statement in (
+            "DROP TRIGGER casts_mirror_insert ON casts",
+            "DROP TRIGGER casts_mirror_update ON casts",
+            "DROP TRIGGER casts_mirror_delete ON casts",
+            "DROP FUNCTION mirror_casts_to_partitioned()",
+            "DROP TABLE casts_copy_progress",
+            "DROP TABLE casts_partitioned"):
+        db.session.execute(text(statement))
+    db.session.commit()
@@ -0,0 +1,248 @@
+import math
+import threading
+import time
+import uuid
+
+from flask import current_app, g
+
+'''
+RateLimitExceeded Exception
+    raised by the limiter when a caller is over its rate or concurrency quota
+    create_app turns it into a 429 with Retry-After and RateLimit-* headers
+'''
+class RateLimitExceeded(Exception):
+    def __init__(self, description, retry_after):
+        self.description = description
+        self.retry_after = retry_after
+
+
+'''
+MemoryBackend
+    an in-process store for token buckets and in-flight counters
+    keys are spread over a power of two number of shards, each guarded by its
+    own lock, so concurrent requests for different callers rarely contend
+    it is per worker process; use a shared backend to enforce limits across
+    gunicorn workers, or this one as the stand-in for tests
+    a bucket that has refilled to its burst is the same as no bucket, so each
+    shard drops those at most every sweep_interval seconds; memory follows
+    the callers seen lately, not every caller since the worker started
+
+    backend interface (implemented by every backend):
+        take_token(key, rate, burst) -> (allowed, remaining, retry_after)
+        acquire_slot(key, limit) -> a lease to pass to release_slot, or None
+        release_slot(key, lease)
+'''
+class MemoryBackend:
+    def __init__(self, shards=64, clock=time.monotonic, sweep_interval=60):
+        if shards & (shards - 1):
+            raise ValueError("shards must be a power of two")
+        self.mask = shards - 1
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.buckets = [{} for _ in range(shards)]
+        self.next_sweep = [clock() + sweep_interval] * shards
+        self.slots = [{} for _ in range(shards)]
+
+    # a bucket is (tokens, last update, time it is full again)
+    def take_token(self, key, rate, burst):
+        shard = hash(key) & self.mask
+        now = self.clock()
+        with self.locks[shard]:
+            buckets = self.buckets[shard]
+            if now >= self.next_sweep[shard]:
+                for idle in [name for name, state in buckets.items() if state[2] <= now]:
+                    del buckets[idle]
+                self.next_sweep[shard] = now + self.sweep_interval
+
+            state = buckets.get(key)
+            if state is None:
+                tokens = burst
+            else:
+                tokens = min(burst, state[0] + (now - state[1]) * rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if allowed:
+                return True, int(tokens), 0.0
+            return False, 0, (1 - tokens) / rate
+
+    def acquire_slot(self, key, limit):
+        shard = hash(key) & self.mask
+        with self.locks[shard]:
+            slots = self.slots[shard]
+            in_flight = slots.get(key, 0)
+            if in_flight >= limit:
+                return None
+            slots[key] = in_flight + 1
+            return True
+
+    def release_slot(self, key, lease):
+        shard = hash(key) & self.mask
+        with self.locks[shard]:
+            slots = self.slots[shard]
+            in_flight = slots.get(key, 0) - 1
+            if in_flight > 0:
+                slots[key] = in_flight
+            else:
+                slots.pop(key, None)
+
+
+'''
+RedisBackend
+    a shared backend so all workers and hosts draw from the same quotas
+    the token bucket runs as one lua script, so a check is a single round trip
+    in-flight slots are leases in a sorted set scored by acquisition time; a
+    lease older than slot_lease seconds no longer counts, so the slots of a
+    worker that died mid-request are freed instead of leaking
+    requires the optional `redis` package and a client passed in by the caller
+'''
+class RedisBackend:
+    TOKEN_SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + (now - ts) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+    return {allowed, tostring(tokens)}
+    """
+
+    SLOT_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local lease = tonumber(ARGV[2])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - lease)
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+        return 0
+    end
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], math.ceil(lease * 1000))
+    return 1
+    """
+
+    def __init__(self, client, prefix='ratelimit:', slot_lease=60):
+        self.client = client
+        self.prefix = prefix
+        self.slot_lease = slot_lease
+        self.take = client.register_script(self.TOKEN_SCRIPT)
+        self.acquire = client.register_script(self.SLOT_SCRIPT)
+
+    def take_token(self, key, rate, burst):
+        allowed, tokens = self.take(
+            keys=[self.prefix + 'bucket:' + key],
+            args=[rate, burst, time.time()]
+        )
+        tokens = float(tokens)
+        if allowed:
+            return True, int(tokens), 0.0
+        return False, 0, (1 - tokens) / rate
+
+    def acquire_slot(self, key, limit):
+        lease = uuid.uuid4().hex
+        acquired = self.acquire(
+            keys=[self.prefix + 'slots:' + key],
+            args=[time.time(), self.slot_lease, limit, lease]
+        )
+        return lease if acquired else None
+
+    def release_slot(self, key, lease):
+        self.client.zrem(self.prefix + 'slots:' + key, lease)
+
+
+'''
+RateLimiter
+    applies the configured quotas for a decoded JWT payload and permission
+        RATELIMIT_DEFAULT: (tokens per second, burst) for every permission
+        RATELIMIT_PERMISSIONS: {permission: (tokens per second, burst)} overrides
+        RATELIMIT_CONCURRENCY: max in-flight requests per `sub` (0 disables)
+'''
+class RateLimiter:
+    def __init__(self, backend, default, permissions, concurrency):
+        self.backend = backend
+        self.default = default
+        self.permissions = permissions
+        self.concurrency = concurrency
+
+    '''
+    check(payload, permission)
+        takes an in-flight slot, then a token from the (sub, permission) bucket
+        the slot goes first so a request turned away for concurrency does not
+        spend rate; the slot is given back when the bucket is empty
+        it will raise a RateLimitExceeded if either quota is exhausted; the
+        RateLimit-* headers then describe the quota that was (the concurrency
+        cap has no bucket to refill, so its reset is the one second retry)
+        return the slot to pass to release(), or None when no slot was taken
+    '''
+    def check(self, payload, permission):
+        subject = payload.get('sub', '')
+        rate, burst = self.permissions.get(permission, self.default)
+
+        slot = None
+        if self.concurrency:
+            lease = self.backend.acquire_slot(subject, self.concurrency)
+            if lease is None:
+                g.ratelimit = (self.concurrency, 0, 1)
+                raise RateLimitExceeded('Too Many Concurrent Requests', 1)
+            slot = (subject, lease)
+
+        allowed, remaining, retry_after = self.backend.take_token(
+            f"{subject}|{permission}", rate, burst
+        )
+        # reset: seconds until the bucket is full again (or usable, when empty)
+        reset = (burst - remaining) / rate if allowed else retry_after
+        g.ratelimit = (burst, remaining, reset)
+        if not allowed:
+            self.release(slot)
+            raise RateLimitExceeded('Rate Limit Exceeded', retry_after)
+        return slot
+
+    def release(self, slot):
+        if slot is not None:
+            self.backend.release_slot(*slot)
+
+
+'''
+ratelimit_headers(response)
+    adds RateLimit-Limit / RateLimit-Remaining / RateLimit-Reset when the
+    request went through the limiter
+'''
+def ratelimit_headers(response):
+    state = g.get('ratelimit')
+    if state is not None:
+        limit, remaining, reset = state
+        response.headers['RateLimit-Limit'] = str(limit)
+        response.headers['RateLimit-Remaining'] = str(remaining)
+        response.headers['RateLimit-Reset'] = str(math.ceil(reset))
+    return response
+
+
+'''
+setup_ratelimit(app)
+    attaches a RateLimiter when RATELIMIT_ENABLED is set
+    RATELIMIT_BACKEND may hold a backend instance (e.g. RedisBackend);
+    by default each process gets its own MemoryBackend
+'''
+def setup_ratelimit(app):
+    if not app.config['RATELIMIT_ENABLED']:
+        return
+    backend = app.config.get('RATELIMIT_BACKEND') or MemoryBackend()
+    app.extensions['ratelimiter'] = RateLimiter(
+        backend,
+        tuple(app.config['RATELIMIT_DEFAULT']),
+        dict(app.config['RATELIMIT_PERMISSIONS']),
+        app.config['RATELIMIT_CONCURRENCY'],
+    )
+
+
+def get_limiter():
+    return current_app.extensions.get('ratelimiter')
@@ -0,0 +1,170 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+'''
+Slow query log
+
+Engine events time every statement; one slower than SLOW_QUERY_THRESHOLD_MS
+is logged with the route that issued it, its redacted parameters and its
+duration, and kept in a bounded ring buffer read by
+GET /api/v1/admin/slow-queries.
+
+For a SLOW_QUERY_EXPLAIN_RATE sample of slow SELECTs the plan is captured
+as well: EXPLAIN (ANALYZE, BUFFERS) on PostgreSQL, inside a savepoint so a
+failing EXPLAIN cannot abort the request's transaction, and EXPLAIN QUERY
+PLAN on SQLite. ANALYZE runs the query a second time, so keep the rate low.
+'''
+
+
+'''
+SlowQueryLog
+    the ring buffer; the oldest entries fall off once `size` is reached
+'''
+class SlowQueryLog:
+    def __init__(self, size):
+        self.entries = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+
+    def recent(self, limit):
+        with self.lock:
+            entries = list(self.entries)
+        return entries[::-1][:limit]
+
+
+'''
+redact(parameters)
+    keeps the shape of bound parameters but never their values
+    e.g. ('Tom Cruise', 3) -> ['str(10)', 'int']
+'''
+def redact(parameters):
+    if isinstance(parameters, dict):
+        return {key: redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_value(value) for value in parameters]
+    return redact_value(parameters)
+
+
+def redact_value(value):
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}({len(value)})'
+    if isinstance(value, (list, tuple)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+'''
+explain(cursor, dialect, statement, parameters)
+    return the plan of a SELECT as text, or None when it cannot be captured
+    runs on the raw DBAPI connection so it is neither timed nor logged itself
+'''
+def explain(cursor, dialect, statement, parameters):
+    explain_cursor = cursor.connection.cursor()
+    try:
+        if dialect == 'postgresql':
+            explain_cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                explain_cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + statement, parameters)
+                plan = '\n'.join(row[0] for row in explain_cursor.fetchall())
+            except Exception:
+                explain_cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                raise
+            explain_cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return plan
+        if dialect == 'sqlite':
+            explain_cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            return '\n'.join(row[-1] for row in explain_cursor.fetchall())
+    except Exception:
+        logger.debug('could not capture a plan', exc_info=True)
+    finally:
+        explain_cursor.close()
+    return None
+
+
+def start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+
+def check_duration(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('slow_query_start')
+    if not starts:
+        return
+    duration_ms = (time.perf_counter() - starts.pop()) * 1e3
+
+    if not has_app_context():
+        return
+    log = current_app.extensions.get('slow_query_log')
+    config = current_app.config
+    if log is None or duration_ms < config['SLOW_QUERY_THRESHOLD_MS']:
+        return
+
+    route = None
+    if has_request_context():
+        route = f'{request.method} {request.path}'
+
+    plan = None
+    if (not executemany and statement.lstrip()[:6].upper() == 'SELECT'
+            and random.random() < config['SLOW_QUERY_EXPLAIN_RATE']):
+        plan = explain(cursor, conn.dialect.name, statement, parameters)
+
+    entry = {
+        'at': datetime.utcnow().isoformat() + 'Z',
+        'route': route,
+        'duration_ms': round(duration_ms, 3),
+        'statement': statement,
+        'parameters': redact(parameters[0] if executemany and parameters else parameters),
+        'executemany': executemany,
+        'plan': plan,
+    }
+    log.add(entry)
+    logger.warning('slow query (%.1f ms) on %s: %s', duration_ms, route, statement)
+
+
+# a failed statement never reaches after_cursor_execute; drop its timer
+# here, or the stack grows for as long as the pooled connection lives
+def drop_timer(context):
+    if context.connection is None:
+        return
+    starts = context.connection.info.get('slow_query_start')
+    if starts:
+        starts.pop()
+
+
+TIMING_EVENTS = (
+    ('before_cursor_execute', start_timer),
+    ('after_cursor_execute', check_duration),
+    ('handle_error', drop_timer),
+)
+
+
+'''
+time_statements(engine)
+    registers the timing events above on one engine, once; setup_db hands it
+    to the app's engine as it is created
+'''
+def time_statements(engine):
+    for name, listener in TIMING_EVENTS:
+        if not event.contains(engine, name, listener):
+            event.listen(engine, name, listener)
+
+
+'''
+setup_slow_query_log(app)
+    attaches the ring buffer when SLOW_QUERY_ENABLED is set; the timing
+    events of the app's engine look it up
+'''
+def setup_slow_query_log(app):
+    if app.config.get('SLOW_QUERY_ENABLED'):
+        app.extensions['slow_query_log'] = SlowQueryLog(app.config['SLOW_QUERY_LOG_SIZE'])
@@ -0,0 +1,310 @@
+import json
+import logging
+import queue
+import select
+import threading
+import time
+import weakref
+
+from sqlalchemy import event, text
+
+from models import db, Change
+
+# gevent and psycogreen are only needed under `gunicorn -k gevent`
+try:
+    from gevent import monkey
+    from psycogreen.gevent import patch_psycopg
+except ImportError:  # pragma: no cover - depends on the environment
+    monkey = None
+
+'''
+Live change stream
+
+GET /api/v1/stream pushes the rows of the `changes` table to subscribers as
+server sent events. The change log stays the single source of truth:
+    a doorbell rings after every commit that logged changes
+        PostgresDoorbell: LISTEN/NOTIFY, heard by every worker and host
+        MemoryDoorbell: in-process, the stand-in for SQLite and tests
+    one ChangeBroker thread per process wakes up, reads the new rows once and
+    fans them out to every subscriber's bounded queue
+    a reconnecting client sends Last-Event-ID (a change cursor) and the rows
+    it missed are replayed from the table before live events resume
+
+Idle subscribers cost a queue and a suspended generator, not a thread, when
+the app runs under an async worker such as `gunicorn -k gevent`; psycopg2 is
+then made to yield while it waits on the server (psycogreen), or one query
+would stall every stream of the worker.
+'''
+
+NOTIFY_CHANNEL = 'catalog_changes'
+
+logger = logging.getLogger(__name__)
+
+# every MemoryDoorbell in this process; rung after any commit that logged changes
+memory_doorbells = weakref.WeakSet()
+
+
+'''
+session hooks
+    record_changes and bulk_delete (models.py) flag the session when they log
+    Change rows; bulk_delete does not flush, so the flag is also checked
+    before every commit
+    on PostgreSQL the flag becomes a NOTIFY queued with the transaction, so
+    listeners only ever hear about committed rows; elsewhere the in-process
+    doorbells are rung after the commit
+'''
+@event.listens_for(db.session, 'after_flush')
+def notify_after_flush(session, flush_context):
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    if session.info.pop('changes_logged', False):
+        session.execute(text(f"NOTIFY {NOTIFY_CHANNEL}"))
+
+
+@event.listens_for(db.session, 'before_commit')
+def notify_before_commit(session):
+    notify_after_flush(session, None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def ring_after_commit(session):
+    if session.info.pop('changes_logged', False):
+        for doorbell in list(memory_doorbells):
+            doorbell.ring()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def forget_after_rollback(session, previous_transaction):
+    session.info.pop('changes_logged', None)
+
+
+'''
+MemoryDoorbell
+    an in-process threading.Event, the stand-in for SQLite and tests
+'''
+class MemoryDoorbell:
+    def __init__(self):
+        self.bell = threading.Event()
+        memory_doorbells.add(self)
+
+    def ring(self):
+        self.bell.set()
+
+    def wait(self, timeout):
+        rung = self.bell.wait(timeout)
+        self.bell.clear()
+        return rung
+
+    def close(self):
+        pass
+
+
+'''
+PostgresDoorbell
+    a dedicated autocommit connection that LISTENs for the NOTIFY above,
+    so every worker process (and host) hears about every commit
+    the connection is opened by the broker thread, on first use, straight
+    from the driver: it never enters the engine's pool, so its autocommit
+    mode and LISTEN can not leak into a request's session, and close()
+    really closes it
+'''
+class PostgresDoorbell:
+    def __init__(self, app):
+        self.app = app
+        self.connection = None
+
+    def listen(self):
+        with self.app.app_context():
+            engine = db.engine
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        self.connection = engine.dialect.connect(*cargs, **cparams)
+        self.connection.set_isolation_level(0)  # autocommit, required for LISTEN
+        self.connection.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+
+    def wait(self, timeout):
+        if self.connection is None:
+            self.listen()
+        ready, _, _ = select.select([self.connection], [], [], timeout)
+        if not ready:
+            return False
+        self.connection.poll()
+        # notifications are collapsed; one wake-up reads every new row
+        rung = bool(self.connection.notifies)
+        self.connection.notifies.clear()
+        return rung
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+'''
+Subscriber
+    one connected client; its queue is bounded by STREAM_BUFFER_SIZE
+    when a slow client lets it fill up the subscriber is marked overflowed
+    and disconnected; it reconnects with Last-Event-ID and replays from the table
+'''
+class Subscriber:
+    def __init__(self, buffer_size, include_actors):
+        self.events = queue.Queue(buffer_size)
+        self.include_actors = include_actors
+        self.overflowed = False
+        self.last_id = 0
+
+    def offer(self, change):
+        if self.overflowed:
+            return
+        if change['entity'] == 'actor' and not self.include_actors:
+            return
+        try:
+            self.events.put_nowait(change)
+        except queue.Full:
+            self.overflowed = True
+
+
+'''
+ChangeBroker
+    a single thread per process that turns doorbell rings into queries
+    against `changes`, batch_size rows at a time, and fans the rows out to
+    every subscriber
+    nothing is read while nobody is subscribed; the next subscriber starts
+    from the newest cursor again, so the changes of an idle period are not
+    delivered as live (a reconnecting client replays them with Last-Event-ID)
+'''
+class ChangeBroker:
+    def __init__(self, app, doorbell, poll_interval, batch_size=500):
+        self.app = app
+        self.doorbell = doorbell
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.last_id = None
+        self.thread = None
+
+    '''
+    subscribe(subscriber)
+        runs on the request thread, inside the stream request
+        the newest cursor is read with the request's session, which the
+        backlog query of the route uses next and the request's teardown removes
+    '''
+    def subscribe(self, subscriber):
+        newest = db.session.query(db.func.coalesce(db.func.max(Change.id), 0)).scalar()
+        with self.lock:
+            if not self.subscribers:
+                self.last_id = newest
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='change-broker', daemon=True)
+                self.thread.start()
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def run(self):
+        while True:
+            try:
+                # the timeout doubles as a safety net for a missed ring
+                self.doorbell.wait(self.poll_interval)
+                with self.lock:
+                    if not self.subscribers:
+                        continue
+                self.dispatch()
+            except Exception:
+                # e.g. the database restarted; reconnect and catch up next round
+                logger.exception("change broker failed; retrying")
+                self.doorbell.close()
+                time.sleep(self.poll_interval)
+
+    # runs on the broker thread, whose session it removes when done
+    def dispatch(self):
+        while True:
+            with self.lock:
+                since = self.last_id
+            with self.app.app_context():
+                rows = (Change.query.filter(Change.id > since)
+                        .order_by(Change.id).limit(self.batch_size).all())
+                changes = [row.format() for row in rows]
+                db.session.remove()
+            with self.lock:
+                # a subscriber after an idle period moved the cursor meanwhile
+                if self.last_id != since:
+                    return
+                if changes:
+                    self.last_id = changes[-1]['cursor']
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                for change in changes:
+                    subscriber.offer(change)
+            if len(changes) < self.batch_size:
+                return
+
+
+'''
+format_event(change)
+    a change row as one server sent event; the cursor is the event id
+'''
+def format_event(change):
+    data = json.dumps({
+        'entity': change['entity'],
+        'id': change['id'],
+        'op': change['op'],
+        'version': change['version']
+    })
+    return f"id: {change['cursor']}\nevent: change\ndata: {data}\n\n"
+
+
+'''
+event_stream(broker, subscriber, backlog, heartbeat)
+    the generator behind a stream response
+    it will yield the replayed backlog, then live events, and a comment line
+    every `heartbeat` seconds of silence so proxies keep the connection open
+    it ends after a buffer overflow, telling the client to reconnect
+'''
+def event_stream(broker, subscriber, backlog, heartbeat):
+    try:
+        yield "retry: 1000\n\n"
+        for change in backlog:
+            subscriber.last_id = change['cursor']
+            yield format_event(change)
+
+        while not subscriber.overflowed:
+            try:
+                change = subscriber.events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            # live rows already sent as part of the replay are skipped
+            if change['cursor'] <= subscriber.last_id:
+                continue
+            subscriber.last_id = change['cursor']
+            yield format_event(change)
+
+        yield "event: overflow\ndata: {}\n\n"
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+'''
+setup_stream(app)
+    picks the doorbell for the configured database and attaches a broker
+    the broker thread itself only starts with the first subscriber
+    under gevent, psycopg2 waits cooperatively (psycogreen)
+'''
+def setup_stream(app):
+    if not app.config['STREAM_ENABLED']:
+        return
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        if monkey is not None and monkey.is_module_patched('socket'):
+            patch_psycopg()
+        doorbell = PostgresDoorbell(app)
+    else:
+        doorbell = MemoryDoorbell()
+    app.extensions['change_broker'] = ChangeBroker(
+        app, doorbell, app.config['STREAM_POLL_INTERVAL'], app.config['STREAM_BATCH_SIZE']
+    )
@@ -0,0 +1,197 @@
+import unittest
+from datetime import date
+
+from models import db, Actor, Movie
+from testing import QueryRecorder, TransactionalTestCase
+
+'''
+Query budgets
+    the most statements each route may issue for one request, whatever the
+    number of rows involved; a route without a budget fails
+    test_every_route_has_a_budget, so new routes must declare one here
+'''
+BUDGETS = {
+    ('GET', '/api/v1/actors'): 1,
+    ('GET', '/api/v1/actors?ids'): 1,
+    ('POST', '/api/v1/actors/batch'): 1,
+    ('GET', '/api/v1/actors/<int:id>'): 1,
+    ('POST', '/api/v1/actors'): 3,
+    # invalid bodies are rejected before any database work
+    ('POST', '/api/v1/actors?invalid'): 0,
+    ('PATCH', '/api/v1/actors/<int:id>?invalid'): 0,
+    ('PATCH', '/api/v1/actors/<int:id>'): 4,
+    # actor deletes bump and log the movies they leave (one UPDATE and one
+    # INSERT ... SELECT, see log_cast_movie_updates); without cast summary
+    # triggers (SQLite) they issue one more UPDATE of those movies' summary
+    ('DELETE', '/api/v1/actors/<int:id>'): 6,
+    # one INSERT ... SELECT of the tombstones and one DELETE; casts cascade
+    ('DELETE', '/api/v1/actors'): 5,
+    # one query for the movies and one for every cast (selectinload)
+    ('GET', '/api/v1/movies'): 2,
+    ('GET', '/api/v1/movies?ids'): 2,
+    ('GET', '/api/v1/movies?compact'): 1,
+    ('POST', '/api/v1/movies/batch'): 2,
+    ('GET', '/api/v1/movies/<int:id>'): 2,
+    ('POST', '/api/v1/movies'): 6,
+    ('POST', '/api/v1/movies?invalid'): 0,
+    ('PATCH', '/api/v1/movies/<int:id>?invalid'): 0,
+    ('PATCH', '/api/v1/movies/<int:id>'): 8,
+    ('DELETE', '/api/v1/movies/<int:id>'): 3,
+    ('DELETE', '/api/v1/movies'): 2,
+    ('GET', '/api/v1/changes'): 2,
+    ('GET', '/api/v1/stream'): 3,
+    ('GET', '/api/v1/admin/slow-queries'): 0,
+    # the INSERT and the reload after commit; the work itself runs in the
+    # job workers (see jobs.py)
+    ('POST', '/api/v1/jobs'): 2,
+    ('POST', '/api/v1/jobs?invalid'): 0,
+    ('GET', '/api/v1/jobs/<int:id>'): 1,
+}
+
+
+class QueryBudgetTestCase(TransactionalTestCase):
+    """This class checks the number of SQL statements issued per request"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.headers = {'Authorization': 'Bearer {}'.format(cls.jwt_executive_producer)}
+        with cls.app.app_context():
+            cls.recorder = QueryRecorder(db.engine)
+
+    def seed(self, count):
+        with self.app.app_context():
+            actors = [Actor('Actor {}'.format(n), 'female', date(1980, 1, 1)) for n in range(count)]
+            db.session.add_all(actors)
+            for n in range(count):
+                db.session.add(Movie('Movie {}'.format(n), date(2023, 1, 1), actors[n:n + 3]))
+            db.session.commit()
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+
+    '''
+    request(budget, method, path, **kwargs)
+        issues the request through the test client while recording statements
+        it will fail listing every statement if the budget is exceeded
+    '''
+    def request(self, budget, method, path, **kwargs):
+        headers = {**self.headers, **kwargs.pop('headers', {})}
+        with self.recorder.record() as recorder:
+            res = self.client.open(path, method=method, headers=headers, **kwargs)
+        limit = BUDGETS[budget]
+        if len(recorder) > limit:
+            self.fail('{} {} issued {} statements, budget is {}:\n{}'.format(
+                method, path, len(recorder), limit, recorder.report()))
+        return res
+
+    def test_every_route_has_a_budget(self):
+        routes = {budget[1] for budget in BUDGETS}
+        for rule in self.app.url_map.iter_rules():
+            if rule.endpoint != 'static':
+                self.assertIn(rule.rule, routes)
+
+    def test_list_budgets_do_not_grow_with_rows(self):
+        for _ in range(2):
+            res = self.request(('GET', '/api/v1/actors'), 'GET', '/api/v1/actors')
+            self.assertEqual(res.status_code, 200)
+            res = self.request(('GET', '/api/v1/movies'), 'GET', '/api/v1/movies')
+            self.assertEqual(res.status_code, 200)
+            res = self.request(('GET', '/api/v1/movies?compact'), 'GET', '/api/v1/movies?compact=true')
+            self.assertEqual(res.status_code, 200)
+            self.seed(20)
+
+    def test_batch_budgets(self):
+        res = self.request(('GET', '/api/v1/actors?ids'), 'GET', '/api/v1/actors?ids=1,2,3,999')
+        self.assertEqual(res.status_code, 200)
+        res = self.request(('POST', '/api/v1/actors/batch'), 'POST', '/api/v1/actors/batch', json={'ids': [3, 2, 1]})
+        self.assertEqual(res.status_code, 200)
+        res = self.request(('GET', '/api/v1/movies?ids'), 'GET', '/api/v1/movies?ids=1,2,3,999')
+        self.assertEqual(res.status_code, 200)
+        res = self.request(('POST', '/api/v1/movies/batch'), 'POST', '/api/v1/movies/batch', json={'ids': [3, 2, 1]})
+        self.assertEqual(res.status_code, 200)
+
+    def test_detail_budgets(self):
+        res = self.request(('GET', '/api/v1/actors/<int:id>'), 'GET', '/api/v1/actors/1')
+        self.assertEqual(res.status_code, 200)
+        res = self.request(('GET', '/api/v1/movies/<int:id>'), 'GET', '/api/v1/movies/1')
+        self.assertEqual(res.status_code, 200)
+
+    def test_actor_write_budgets(self):
+        res = self.request(('POST', '/api/v1/actors'), 'POST', '/api/v1/actors',
+                           json={'name': 'Budget', 'gender': 'female', 'dob': '1990-01-01'})
+        self.assertEqual(res.status_code, 200)
+        id = res.get_json()['actors'][0]['id']
+
+        res = self.request(('PATCH', '/api/v1/actors/<int:id>'), 'PATCH', '/api/v1/actors/{}'.format(id),
+                           json={'name': 'Budget Again'})
+        self.assertEqual(res.status_code, 200)
+
+        res = self.request(('DELETE', '/api/v1/actors/<int:id>'), 'DELETE', '/api/v1/actors/{}'.format(id))
+        self.assertEqual(res.status_code, 200)
+
+    def test_movie_write_budgets(self):
+        for cast_size in (1, 10):
+            res = self.request(('POST', '/api/v1/movies'), 'POST', '/api/v1/movies',
+                               json={'title': 'Budget', 'release_date': '2024-01-01', 'cast': list(range(1, cast_size + 1))})
+            self.assertEqual(res.status_code, 200)
+            id = res.get_json()['movies'][0]['id']
+
+            res = self.request(('PATCH', '/api/v1/movies/<int:id>'), 'PATCH', '/api/v1/movies/{}'.format(id),
+                               json={'title': 'Budget Again', 'cast': list(range(2, cast_size + 3))})
+            self.assertEqual(res.status_code, 200)
+
+            res = self.request(('DELETE', '/api/v1/movies/<int:id>'), 'DELETE', '/api/v1/movies/{}'.format(id))
+            self.assertEqual(res.status_code, 200)
+
+    def test_delete_budgets_do_not_grow_with_cast(self):
+        self.seed(20)
+        with self.app.app_context():
+            ids = [id for id, in db.session.query(Movie.id).order_by(Movie.id.desc()).limit(4)]
+            actor_ids = [id for id, in db.session.query(Actor.id).order_by(Actor.id.desc()).limit(4)]
+
+        res = self.request(('DELETE', '/api/v1/movies/<int:id>'), 'DELETE', '/api/v1/movies/{}'.format(ids[0]))
+        self.assertEqual(res.status_code, 200)
+        res = self.request(('DELETE', '/api/v1/actors/<int:id>'), 'DELETE', '/api/v1/actors/{}'.format(actor_ids[0]))
+        self.assertEqual(res.status_code, 200)
+        res = self.request(('DELETE', '/api/v1/movies'), 'DELETE', '/api/v1/movies',
+                           json={'ids': ids[1:]})
+        self.assertEqual(res.get_json()['deleted'], 3)
+        res = self.request(('DELETE', '/api/v1/actors'), 'DELETE', '/api/v1/actors?ids={}'.format(
+            ','.join(map(str, actor_ids[1:]))))
+        self.assertEqual(res.get_json()['deleted'], 3)
+
+    def test_invalid_bodies_skip_the_database(self):
+        for method, rule, path, body in (
+                ('POST', '/api/v1/actors', '/api/v1/actors', {'name': 'Budget', 'dob': 'yesterday'}),
+                ('PATCH', '/api/v1/actors/<int:id>', '/api/v1/actors/1', {'version': '1'}),
+                ('POST', '/api/v1/movies', '/api/v1/movies', {'title': 'Budget', 'cast': 'all'}),
+                ('PATCH', '/api/v1/movies/<int:id>', '/api/v1/movies/1', {'release_date': 20240101}),
+                ('POST', '/api/v1/jobs', '/api/v1/jobs', {'kind': 'purge-movies', 'params': {'ids': '1,2'}})):
+            res = self.request((method, rule + '?invalid'), method, path, json=body)
+            self.assertEqual(res.status_code, 400)
+
+    def test_job_budgets_do_not_grow_with_rows(self):
+        rows = [{'title': 'Budget {}'.format(n), 'release_date': '2024-01-01'} for n in range(200)]
+        res = self.request(('POST', '/api/v1/jobs'), 'POST', '/api/v1/jobs',
+                           json={'kind': 'import-movies', 'params': {'rows': rows}})
+        self.assertEqual(res.status_code, 202)
+        id = res.get_json()['jobs'][0]['id']
+
+        res = self.request(('GET', '/api/v1/jobs/<int:id>'), 'GET', '/api/v1/jobs/{}'.format(id))
+        self.assertEqual(res.status_code, 200)
+
+    def test_change_feed_budgets(self):
+        res = self.request(('GET', '/api/v1/changes'), 'GET', '/api/v1/changes?since=0&limit=50')
+        self.assertEqual(res.status_code, 200)
+
+        res = self.request(('GET', '/api/v1/stream'), 'GET', '/api/v1/stream',
+                           headers={'Last-Event-ID': '0'}, buffered=False)
+        self.assertEqual(res.status_code, 200)
+        res.close()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+from collections import namedtuple
+from datetime import date, datetime
+from functools import lru_cache
+
+'''
+Request validation
+
+Every write route checks its json body against a Schema before it touches
+the session, so a bad payload costs neither a database round trip nor a
+rollback. A Schema is compiled once, at import, into a tuple of per field
+checks; validate() walks it and collects every failure, and the route
+answers 400 with one message per field:
+    {"success": False, "error": 400, "message": "Bad Request",
+     "errors": {"dob": "Must Be A Date Such As 1962-07-03"}}
+'''
+
+
+'''
+ValidationError Exception
+    raised by Schema.validate with a {field: message} dict
+    create_app turns it into a 400 listing the errors
+'''
+class ValidationError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+
+
+DATE_FORMATS = ('%B %d, %Y', '%b %d, %Y')
+
+'''
+parse_date(value)
+    "1962-07-03", "July 3, 1962" or "Jul 3, 1962" as a date
+    it will raise a ValueError for anything else
+    results, failures included, are cached: strptime is slow and clients
+    repeat the same dates
+'''
+def parse_date(value):
+    parsed = cached_parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+@lru_cache(maxsize=4096)
+def cached_parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    for format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, format).date()
+        except ValueError:
+            pass
+    return None
+
+
+'''
+Field
+    check(value) returns the cleaned value or raises ValueError(message)
+'''
+Field = namedtuple('Field', 'check required')
+
+
+def string(required=False):
+    def check(value):
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError('Must Be A Non-Empty String')
+        return value
+    return Field(check, required)
+
+
+def integer(required=False):
+    def check(value):
+        # bool is an int to python, not to clients
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError('Must Be An Integer')
+        return value
+    return Field(check, required)
+
+
+def date_field(required=False):
+    def check(value):
+        # MessagePack bodies carry dates as dates (see negotiation.py)
+        if isinstance(value, date) and not isinstance(value, datetime):
+            return value
+        parsed = cached_parse_date(value) if isinstance(value, str) else None
+        if parsed is None:
+            raise ValueError('Must Be A Date Such As 1962-07-03')
+        return parsed
+    return Field(check, required)
+
+
+def id_list(required=False):
+    def check(value):
+        if not isinstance(value, list) or not all(
+                isinstance(id, int) and not isinstance(id, bool) for id in value):
+            raise ValueError('Must Be A List Of Integer Ids')
+        return value
+    return Field(check, required)
+
+
+def choice(*values, required=False):
+    message = 'Must Be One Of ' + ', '.join(values)
+    def check(value):
+        if value not in values:
+            raise ValueError(message)
+        return value
+    return Field(check, required)
+
+
+'''
+list_of(schema)
+    a list of json objects, each checked against schema
+    failures are reported per item, e.g. {"rows[3].dob": "Must Be A Date ..."}
+'''
+def list_of(schema, required=False):
+    def check(value):
+        if not isinstance(value, list):
+            raise ValueError('Must Be A List')
+        clean = []
+        errors = {}
+        for index, item in enumerate(value):
+            try:
+                clean.append(schema.validate(item))
+            except ValidationError as error:
+                for name, message in error.errors.items():
+                    errors[f'[{index}].{name}'] = message
+        if errors:
+            raise ValidationError(errors)
+        return clean
+    return Field(check, required)
+
+
+'''
+Schema
+    Schema(name=string(required=True), dob=date_field(), ...)
+    validate(body) returns a dict of the known fields present in body, cleaned
+        it will raise a ValidationError naming every missing or invalid field
+        unknown fields are ignored
+        a field holding a nested schema (list_of) reports its own fields
+        under its name, e.g. "rows[3].dob"
+'''
+class Schema:
+    def __init__(self, **fields):
+        self.checks = tuple((name, field.check) for name, field in fields.items())
+        self.required = tuple(name for name, field in fields.items() if field.required)
+
+    def validate(self, body):
+        if not isinstance(body, dict):
+            raise ValidationError({'body': 'Must Be An Object'})
+
+        clean = {}
+        errors = None
+        for name, check in self.checks:
+            if name not in body:
+                continue
+            try:
+                clean[name] = check(body[name])
+            except ValueError as error:
+                if errors is None:
+                    errors = {}
+                errors[name] = str(error)
+            except ValidationError as error:
+                if errors is None:
+                    errors = {}
+                for nested, message in error.errors.items():
+                    errors[name + nested] = message
+
+        for name in self.required:
+            if name not in body:
+                if errors is None:
+                    errors = {}
+                errors[name] = 'Required'
+
+        if errors:
+            raise ValidationError(errors)
+        return clean
+
+
+ACTOR_CREATE = Schema(name=string(True), gender=string(True), dob=date_field(True))
+ACTOR_UPDATE = Schema(name=string(), gender=string(), dob=date_field(), version=integer())
+MOVIE_CREATE = Schema(title=string(True), release_date=date_field(True), cast=id_list())
+MOVIE_UPDATE = Schema(title=string(), release_date=date_field(), cast=id_list(), version=integer())